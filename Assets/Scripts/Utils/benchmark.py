@@ -0,0 +1,215 @@
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import timeit
+
+import numpy as np
+
+import metrics
+from metrics import Layouts
+
+# one "1x" results directory looks like the study we have: 4 sessions of 12 challenges, ~25 keypresses each
+sessions_per_scale = 4
+raycast_neighbours = {c: row[max(0, i - 1)] + row[min(len(row) - 1, i + 1)]
+                      for row in ['QWERTYUIOP', 'ASDFGHJKL;', 'ZXCVBNM,. '] for i, c in enumerate(row)}
+
+
+def synthetic_keys(prompt, keypresses, rng, error_rate=0.1):
+    # a typist walking through the prompt who sometimes hits a neighbouring key and sometimes backspaces it
+    keys = list()
+    typed = 0
+    while len(keys) < keypresses:
+        target = prompt[typed % len(prompt)]
+        if rng.random() < error_rate:
+            keys.append(rng.choice(list(raycast_neighbours.get(target, target))))
+            if rng.random() < 0.5 and len(keys) < keypresses:
+                keys.append("\b")
+                continue
+        else:
+            keys.append(target)
+        typed += 1
+    return keys
+
+
+def apply_keys(keys):
+    output = list()
+    for key in keys:
+        if key == "\b":
+            if output:
+                output.pop()
+        else:
+            output.append(key)
+    return ''.join(output)
+
+
+def vector(values):
+    return "[" + ", ".join("%.7g" % v for v in values) + "]"
+
+
+def synthetic_trial(prompts, challenges=12, keypresses=25, seed=0):
+    # a trial file in the exact layout Unity writes (see Results/trial-*.yaml), as a string
+    rng = np.random.default_rng(seed)
+    layout = list(Layouts)[seed % len(Layouts)]
+    lines = ['meta:',
+             '  timestamp: "7/16/2020 2:36:27 AM"',
+             '  unixseconds: %d' % (1594884987 + seed),
+             '  platform: WindowsPlayer',
+             '  xrdevices: ',
+             '    HMD: ',
+             '      - HeadMounted',
+             '      - TrackedDevice',
+             'trial:',
+             '  - command: trial-number',
+             '    data: %d' % seed,
+             '  - command: set-layout',
+             '    data: %d' % list(Layouts).index(layout)]
+
+    clock = 10 * rng.random()
+    for n in range(challenges):
+        kind = 'Practice' if n < challenges // 6 else ('Blind' if n % 2 else 'Perfect')
+        prompt = prompts[rng.integers(len(prompts))]
+        keys = synthetic_keys(prompt, keypresses, rng)
+        output = apply_keys(keys)
+        start = clock
+        times = start + np.cumsum(rng.exponential(0.8, len(keys)) + 0.05)
+        clock = (times[-1] if len(times) else start) + rng.exponential(0.5) + 0.01
+        lines += ['  - challenge:',
+                  '      type: ' + kind,
+                  '      layout: ' + layout.value,
+                  '      prompt: ' + json.dumps(prompt),
+                  '      output: ' + json.dumps(output),
+                  '      accuracy: %.7g' % (sum(a == b for a, b in zip(prompt, output)) / len(prompt)),
+                  '      time:',
+                  '        start: %.7g' % start,
+                  '        stop: %.7g' % clock,
+                  '        duration: %.7g' % (clock - start),
+                  '      keypresses:' + ('' if keys else ' {}')]
+        for t, key in zip(times, keys):
+            lines += ['        %.15g:' % t,
+                      '          key: ' + json.dumps(key),
+                      '          travel:',
+                      '            pos: ' + vector(rng.exponential(0.3, 3)),
+                      '            rot: ' + vector(rng.exponential(100, 3)),
+                      '          pressPos: ' + vector(rng.normal([-0.5, 5, 1.25], 0.2))]
+    return '\n'.join(lines) + '\n'
+
+
+def write_synthetic_results(directory, sessions, challenges=12, keypresses=25, seed=0):
+    with open(metrics.phrases_path) as phrases:
+        prompts = [line.strip().upper() for line in phrases if line.strip()]
+    os.makedirs(directory, exist_ok=True)
+    for session in range(sessions):
+        path = os.path.join(directory, "trial-synthetic-%05d.yaml" % session)
+        with open(path, 'w') as yams:
+            yams.write(synthetic_trial(prompts, challenges, keypresses, seed=seed + session))
+    return metrics.discover_trials(directory)
+
+
+def best_of(fn, repeat):
+    return min(timeit.repeat(fn, number=1, repeat=repeat))
+
+
+def cross_check(pairs, cutoffs=(0, 1, 5), limits=(0, 5, 12.5, 50)):
+    # the fast edit distances have to agree with the reference on every pair before their timings mean anything
+    reference = [int(metrics.levenshtein(p, t)) for p, t in pairs]
+    if list(metrics.batch_levenshtein(pairs)) != reference:
+        raise AssertionError("batch_levenshtein disagrees with levenshtein")
+    if [metrics.myers_levenshtein(p, t) for p, t in pairs] != reference:
+        raise AssertionError("myers_levenshtein disagrees with levenshtein")
+    for cutoff in cutoffs:
+        if [metrics.myers_levenshtein(p, t, cutoff) for p, t in pairs] != [min(d, cutoff + 1) for d in reference]:
+            raise AssertionError("myers_levenshtein with max_distance=%d disagrees with levenshtein" % cutoff)
+        capped = [100 * d / max(len(p), len(t)) if d <= cutoff else float("inf") for (p, t), d in zip(pairs, reference)]
+        if [metrics.error_rate(p, t, max_distance=cutoff) for p, t in pairs] != capped:
+            raise AssertionError("error_rate with max_distance=%d disagrees with levenshtein" % cutoff)
+    rates = [metrics.error_rate(p, t) for p, t in pairs]
+    for limit in limits:
+        if [metrics.within_error_rate(p, t, limit) for p, t in pairs] != [rate <= limit for rate in rates]:
+            raise AssertionError("within_error_rate at %g%% disagrees with error_rate" % limit)
+
+
+def run_benchmarks(scales=(1, 10, 100), repeat=3, workers=None, reference_limit=10):
+    results = list()
+
+    def record(name, scale, seconds, items):
+        results.append({"name": name, "scale": scale, "seconds": seconds, "items": items})
+        print("%-28s %5dx %10.4f s %12.2f us/item" % (name, scale, seconds, 1e6 * seconds / max(items, 1)))
+
+    for scale in scales:
+        directory = tempfile.mkdtemp(prefix="metrics-bench-")
+        try:
+            paths = write_synthetic_results(directory, sessions_per_scale * scale)
+            record("get_trial (parse)", scale,
+                   best_of(lambda: [metrics.read_trial(p, use_cache=False) for p in paths], repeat), len(paths))
+            [metrics.read_trial(p) for p in paths]
+            record("get_trial (cached)", scale, best_of(lambda: [metrics.read_trial(p) for p in paths], repeat),
+                   len(paths))
+
+            challenges, keypresses = metrics.load_tables(paths, workers=1)
+            pairs = list(zip(challenges["prompt"], challenges["output"]))
+            if scale <= reference_limit:
+                record("error_rate (levenshtein)", scale,
+                       best_of(lambda: [metrics.error_rate(*p) for p in pairs], 1), len(pairs))
+                cross_check(pairs)
+            record("error_rate (myers)", scale,
+                   best_of(lambda: [metrics.error_rate(*p, distance=metrics.myers_levenshtein) for p in pairs],
+                           repeat), len(pairs))
+            record("batch_error_rates", scale, best_of(lambda: metrics.batch_error_rates(pairs), repeat), len(pairs))
+            record("keypress_timing", scale, best_of(lambda: metrics.keypress_timing(challenges, keypresses), repeat),
+                   len(keypresses))
+
+            shutil.rmtree(os.path.join(directory, metrics.trial_cache_name))
+            record("get_data (cold)", scale, best_of(lambda: metrics.get_data(directory=directory, workers=workers), 1),
+                   len(challenges))
+            record("get_data", scale, best_of(lambda: metrics.get_data(directory=directory, workers=workers), repeat),
+                   len(challenges))
+            data = metrics.get_data(directory=directory, workers=workers)
+            record("write_csv", scale, best_of(lambda: (metrics.write_csv('main', data.main_csv, directory=directory),
+                                                        metrics.write_csv('travels', data.travel_csv,
+                                                                          directory=directory)), repeat), 2)
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+    return results
+
+
+def compare(results, baseline, tolerance, noise=0.005):
+    # flags every benchmark that got slower than tolerance x its time in the baseline run, ignoring
+    # anything that moved by less than noise seconds
+    before = {(r["name"], r["scale"]): r["seconds"] for r in baseline}
+    regressions = list()
+    for r in results:
+        old = before.get((r["name"], r["scale"]))
+        if old and r["seconds"] > tolerance * old and r["seconds"] - old > noise:
+            regressions.append(r)
+            print("REGRESSION %-28s %5dx %.4f s -> %.4f s" % (r["name"], r["scale"], old, r["seconds"]))
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Time the metrics pipeline on synthetic trial files.")
+    parser.add_argument("--scales", type=int, nargs="+", default=[1, 10, 100],
+                        help="data volume as multiples of the current study (4 sessions)")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--reference-limit", type=int, default=10,
+                        help="largest scale to time the pure-python levenshtein at")
+    parser.add_argument("--save", help="write the timings to this json file")
+    parser.add_argument("--compare", help="json file from an earlier --save to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=1.25)
+    parser.add_argument("--generate", metavar="DIR",
+                        help="only write synthetic trial files for the first scale into DIR")
+    args = parser.parse_args()
+
+    if args.generate:
+        write_synthetic_results(args.generate, sessions_per_scale * args.scales[0])
+        raise SystemExit
+
+    timings = run_benchmarks(args.scales, args.repeat, args.workers, args.reference_limit)
+    if args.save:
+        with open(args.save, 'w') as out:
+            json.dump(timings, out, indent=2)
+    if args.compare:
+        with open(args.compare) as previous:
+            raise SystemExit(1 if compare(timings, json.load(previous), args.tolerance) else 0)
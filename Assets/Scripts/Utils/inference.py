@@ -0,0 +1,117 @@
+import argparse
+from itertools import combinations
+
+import numpy as np
+
+import metrics
+from metrics import Layouts
+
+# the summary metrics that get intervals and tests, as attributes of metrics.Data
+inferred = {"BlindWPM": "layout_blind_wpm", "Error": "layout_error_rates", "PIT": "layout_pit"}
+# resampled values per chunk of work; chunks depend only on this and the sample size, never on
+# the number of workers, so a seed gives the same numbers however the work is spread
+chunk_elements = 1 << 20
+
+
+def chunk_jobs(kind, samples, n, seed):
+    # n resamples of samples, split into jobs that each draw their rows from their own child seed
+    size = sum(len(s) for s in samples)
+    rows = max(1, min(n, chunk_elements // max(size, 1)))
+    counts = [rows] * (n // rows) + ([n % rows] if n % rows else [])
+    seeds = np.random.SeedSequence(seed).spawn(len(counts))
+    return [(kind, samples, count, child) for count, child in zip(counts, seeds)]
+
+
+def resample(job):
+    # one chunk: a (rows, n) matrix of indices (or of shuffled labels) and a mean per row
+    kind, samples, rows, seed = job
+    rng = np.random.default_rng(seed)
+    if kind == "bootstrap":
+        values, = samples
+        return values[rng.integers(0, len(values), (rows, len(values)))].mean(axis=1)
+
+    a, b = samples
+    shuffled = rng.permuted(np.tile(np.concatenate((a, b)), (rows, 1)), axis=1)
+    return shuffled[:, :len(a)].mean(axis=1) - shuffled[:, len(a):].mean(axis=1)
+
+
+def run_jobs(groups, workers=None):
+    # groups is a list of job lists; all their chunks share one pool, and each group gets its
+    # chunks' results back concatenated in order
+    results = iter(metrics.map_files(resample, [job for group in groups for job in group], workers))
+    return [np.concatenate([next(results) for _ in group] or [np.zeros(0)]) for group in groups]
+
+
+def bootstrap_ci(values, n_boot=10000, confidence=0.95, seed=0, workers=None):
+    # percentile interval of the mean from n_boot resamples with replacement
+    values = np.asarray(values, dtype=np.float64)
+    means, = run_jobs([chunk_jobs("bootstrap", (values,), n_boot, seed)], workers)
+    return percentile_interval(means, confidence)
+
+
+def percentile_interval(means, confidence):
+    if not len(means):
+        return np.nan, np.nan
+    tail = 100 * (1 - confidence) / 2
+    return tuple(np.percentile(means, [tail, 100 - tail]))
+
+
+def permutation_test(a, b, n_perm=10000, seed=0, workers=None):
+    # two-sided test of a difference in means, relabelling the pooled values n_perm times
+    a, b = np.asarray(a, dtype=np.float64), np.asarray(b, dtype=np.float64)
+    differences, = run_jobs([chunk_jobs("permutation", (a, b), n_perm, seed)], workers)
+    return p_value(a, b, differences)
+
+
+def p_value(a, b, differences):
+    if not len(a) or not len(b):
+        return np.nan
+    observed = abs(np.mean(a) - np.mean(b))
+    # the small tolerance keeps permutations that tie the observed difference from being lost to rounding
+    return (np.count_nonzero(np.abs(differences) >= observed - 1e-12) + 1) / (len(differences) + 1)
+
+
+def layout_inference(data, n_boot=10000, n_perm=10000, confidence=0.95, seed=0, workers=None):
+    # bootstrap intervals per layout and permutation tests between every pair of layouts for each
+    # inferred metric, on the same values (after reject_outliers) as the summary csvs. Every interval
+    # and test has its own seed derived from seed, so adding a layout doesn't move the others.
+    samples = dict()
+    for m, (metric, field) in enumerate(inferred.items()):
+        for l, layout in enumerate(Layouts):
+            values = np.asarray(getattr(data, field).get(layout.value, []), dtype=np.float64)
+            samples[metric, layout] = (values[np.isfinite(values)], (seed, m, l))
+
+    intervals = [(metric, layout) for (metric, layout), (values, _) in samples.items() if len(values)]
+    tests = [(metric, a, b) for metric in inferred for a, b in combinations(Layouts, 2)
+             if len(samples[metric, a][0]) and len(samples[metric, b][0])]
+    groups = [chunk_jobs("bootstrap", (samples[key][0],), n_boot, samples[key][1]) for key in intervals]
+    groups += [chunk_jobs("permutation", (samples[metric, a][0], samples[metric, b][0]), n_perm,
+                          samples[metric, a][1] + samples[metric, b][1][2:]) for metric, a, b in tests]
+    results = run_jobs(groups, workers)
+
+    ci_csv = [["Layout", "Metric", "Mean", "CI Low", "CI High", "N"]]
+    for (metric, layout), means in zip(intervals, results):
+        values = samples[metric, layout][0]
+        ci_csv.append([layout.value, metric, np.mean(values), *percentile_interval(means, confidence), len(values)])
+
+    test_csv = [["Metric", "Layout A", "Layout B", "Mean Difference", "p"]]
+    for (metric, a, b), differences in zip(tests, results[len(intervals):]):
+        values_a, values_b = samples[metric, a][0], samples[metric, b][0]
+        test_csv.append([metric, a.value, b.value, np.mean(values_a) - np.mean(values_b),
+                         p_value(values_a, values_b, differences)])
+    return ci_csv, test_csv
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Bootstrap intervals and permutation tests per layout.")
+    parser.add_argument("--boot", type=int, default=10000, help="bootstrap resamples per interval")
+    parser.add_argument("--perm", type=int, default=10000, help="relabellings per permutation test")
+    parser.add_argument("--confidence", type=float, default=0.95)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    ci_rows, test_rows = layout_inference(metrics.get_data(incremental=True), args.boot, args.perm,
+                                          args.confidence, args.seed, args.workers)
+    metrics.write_csv('intervals', ci_rows, digits=4)
+    metrics.write_csv('permutation-tests', test_rows, digits=5)
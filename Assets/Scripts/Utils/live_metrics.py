@@ -0,0 +1,245 @@
+import argparse
+import asyncio
+import json
+from collections import defaultdict
+from math import isfinite, sqrt
+
+import metrics
+from metrics import LiveLevenshtein, RunningStats, myers_levenshtein
+
+# One JSON object per line, in the shape the trial files already use:
+#   {"challenge": {"type": "Blind", "layout": "TiltType", "prompt": "...", "time": {"start": 12.5}}}
+#   {"keypresses": {"13.1": {"key": "A", "travel": {"pos": [...], "rot": [...]}, "pressPos": [...]}}}
+#   {"end": {"output": "...", "time": {"start": 12.5, "stop": 20.1, "duration": 7.6}}}
+#   {"query": null}
+# a challenge runs from its "challenge" line to its "end" (or the next "challenge"); every "query"
+# line is answered with one line holding the current challenge and the per-layout aggregates.
+default_port = 8765
+
+
+class LiveChallenge:
+    # running metrics of the challenge being typed, each keypress updating them in constant time
+    def __init__(self, challenge):
+        self.type = challenge.get("type")
+        self.layout = challenge.get("layout")
+        self.prompt = challenge.get("prompt", "")
+        self.start = (challenge.get("time") or {}).get("start")
+        self.last = self.start
+        self.distance = LiveLevenshtein(self.prompt)
+        self.matches = 0
+        self.rot_travel = 0.0
+        self.keypresses = 0
+
+    @property
+    def output(self):
+        return ''.join(self.distance.typed)
+
+    def keypress(self, time, keypress):
+        # same accumulation as challenge_rot_travel, one keypress at a time
+        rot = (keypress.get("travel") or {}).get("rot")
+        if rot is not None:
+            self.rot_travel += sqrt(sum(k * k for k in rot))
+
+        typed = self.distance.typed
+        key = keypress.get("key", "")
+        if key == "\b":
+            if typed:
+                self.matches -= len(typed) <= len(self.prompt) and typed[-1] == self.prompt[len(typed) - 1]
+        elif len(typed) < len(self.prompt):
+            self.matches += key == self.prompt[len(typed)]
+        self.distance.key(key)
+
+        self.start = time if self.start is None else self.start
+        self.last = time
+        self.keypresses += 1
+
+    def duration(self):
+        return self.last - self.start if self.start is not None else 0.0
+
+    def words_per_minute(self, duration=None, output=None):
+        # words_per_minute, with the time so far standing in for the duration until the challenge ends
+        duration = self.duration() if duration is None else duration
+        if duration <= 0:
+            return float("nan")
+        return max(0, len(self.distance.typed if output is None else output) - 1) / 5 / (duration / 60)
+
+    def accuracy(self):
+        # the share of the prompt typed correctly in place, as in accurate_words_per_minutes
+        return self.matches / len(self.prompt) if self.prompt else float("nan")
+
+    def snapshot(self, duration=None, output=None):
+        # output is the one the trial recorded; when the keys don't replay to it, it is scored instead
+        if output is None or output == self.output:
+            output, accuracy, distance = self.output, self.accuracy(), self.distance.distance
+        else:
+            accuracy = sum(a == b for a, b in zip(output, self.prompt)) / len(self.prompt) \
+                if self.prompt else float("nan")
+            distance = myers_levenshtein(self.prompt, output)
+        longest = max(len(self.prompt), len(output))
+        wpm = self.words_per_minute(duration, output)
+        return {"type": self.type, "layout": self.layout, "prompt": self.prompt, "output": output,
+                "keypresses": self.keypresses, "wpm": wpm, "awpm": accuracy * wpm, "accuracy": accuracy,
+                "distance": distance, "error_rate": 100 * distance / longest if longest else 0.0,
+                "rot_travel": self.rot_travel}
+
+
+class LiveMetrics:
+    # the session as events arrive: the open challenge plus RunningStats of every finished one per
+    # (layout, challenge type, metric), so neither grows with the number of keypresses
+    summarized = ("wpm", "awpm", "accuracy", "error_rate", "rot_travel")
+
+    def __init__(self, skip_practice=True):
+        self.skip_practice = skip_practice
+        self.current = None
+        self.stats = defaultdict(RunningStats)
+        self.events = 0
+
+    def handle(self, event):
+        # applies one event; returns the reply for a query, otherwise None
+        self.events += 1
+        if "challenge" in event:
+            self.finish()
+            self.current = LiveChallenge(event["challenge"])
+        # keypresses with no open challenge (after an "end", or after a line that failed to parse)
+        # have no layout to count them under, so they are dropped
+        if "keypresses" in event and self.current is not None:
+            for time, keypress in sorted((float(t), kp) for t, kp in (event["keypresses"] or {}).items()):
+                self.current.keypress(time, keypress)
+        if "end" in event:
+            self.finish(event["end"])
+        if "query" in event:
+            return self.query()
+        return None
+
+    def finish(self, end=None):
+        # folds the open challenge into the aggregates; the recorded duration, when the end event has
+        # one, replaces the keypress-to-keypress time so finished numbers match the offline ones
+        challenge, self.current = self.current, None
+        if challenge is None or (self.skip_practice and challenge.type == 'Practice'):
+            return
+        end = end or {}
+        finished = challenge.snapshot((end.get("time") or {}).get("duration"), end.get("output"))
+        for metric, value in finished.items():
+            if metric in self.summarized and isinstance(value, (int, float)) and isfinite(value):
+                self.stats[challenge.layout, challenge.type, metric].add([value])
+
+    def query(self):
+        aggregates = defaultdict(dict)
+        for (layout, kind, metric), stats in sorted(self.stats.items(), key=lambda item: str(item[0])):
+            aggregates["%s/%s" % (layout, kind)][metric] = {"count": int(stats.count), "mean": stats.mean,
+                                                            "std": stats.std}
+        return {"events": self.events, "current": self.current and self.current.snapshot(),
+                "aggregates": aggregates}
+
+
+async def handle_connection(live, reader, writer):
+    while True:
+        line = await reader.readline()
+        if not line:
+            break
+        try:
+            reply = live.handle(json.loads(line))
+        except (ValueError, TypeError, AttributeError) as e:
+            reply = {"error": str(e)}
+        if reply is not None:
+            writer.write(json.dumps(reply).encode() + b"\n")
+            await writer.drain()
+    writer.close()
+
+
+async def serve(live, host="127.0.0.1", port=default_port, path=None):
+    # listens on a unix socket when path is given, otherwise on TCP
+    def connected(reader, writer):
+        return handle_connection(live, reader, writer)
+
+    if path:
+        server = await asyncio.start_unix_server(connected, path=path)
+    else:
+        server = await asyncio.start_server(connected, host, port)
+    async with server:
+        await server.serve_forever()
+
+
+def trial_events(path):
+    # a recorded trial file as the events the headset would have sent, keypress by keypress
+    for item in metrics.iter_trial(path):
+        challenge = item.get("challenge")
+        if challenge is None:
+            continue
+        times = challenge.get("time") or {}
+        yield None, {"challenge": {"type": challenge["type"], "layout": challenge["layout"],
+                                   "prompt": challenge["prompt"], "time": {"start": times.get("start")}}}
+        for time, keypress in sorted((challenge.get("keypresses") or {}).items()):
+            yield time, {"keypresses": {repr(time): keypress}}
+        yield times.get("stop"), {"end": {"output": challenge["output"], "time": times}}
+
+
+async def replay(paths, host="127.0.0.1", port=default_port, path=None, speed=0.0):
+    # sends recorded trials to a running service, waiting out the recorded gaps divided by speed
+    # (speed=0 sends as fast as possible), and returns its final query
+    if path:
+        reader, writer = await asyncio.open_unix_connection(path)
+    else:
+        reader, writer = await asyncio.open_connection(host, port)
+    previous = None
+    for trial in paths:
+        for time, event in trial_events(trial):
+            if speed and time is not None and previous is not None and time > previous:
+                await asyncio.sleep((time - previous) / speed)
+            previous = time if time is not None else previous
+            writer.write(json.dumps(event).encode() + b"\n")
+            await writer.drain()
+    answer = await query(reader, writer)
+    writer.close()
+    await writer.wait_closed()
+    return answer
+
+
+async def query(reader, writer):
+    writer.write(b'{"query": null}\n')
+    await writer.drain()
+    return json.loads(await reader.readline())
+
+
+def replay_locally(paths, skip_practice=True):
+    # the same events fed straight into a LiveMetrics, with no socket in between
+    live = LiveMetrics(skip_practice)
+    for trial in paths:
+        for _, event in trial_events(trial):
+            live.handle(event)
+    return live
+
+
+async def ask(host="127.0.0.1", port=default_port, path=None):
+    if path:
+        reader, writer = await asyncio.open_unix_connection(path)
+    else:
+        reader, writer = await asyncio.open_connection(host, port)
+    answer = await query(reader, writer)
+    writer.close()
+    await writer.wait_closed()
+    return answer
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Per-keypress metrics of a running trial.")
+    parser.add_argument("command", choices=["serve", "replay", "query"])
+    parser.add_argument("trials", nargs="*", help="trial files to replay (default: every trial in Results)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=default_port)
+    parser.add_argument("--unix", metavar="PATH", help="use a unix socket at PATH instead of TCP")
+    parser.add_argument("--speed", type=float, default=0.0,
+                        help="replay at this multiple of the recorded pace (0: as fast as possible)")
+    parser.add_argument("--local", action="store_true", help="replay into this process instead of a server")
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        asyncio.run(serve(LiveMetrics(), args.host, args.port, args.unix))
+    elif args.command == "replay":
+        trials = args.trials or metrics.discover_trials(metrics.results_dir)
+        if args.local:
+            print(json.dumps(replay_locally(trials).query(), indent=2))
+        else:
+            print(json.dumps(asyncio.run(replay(trials, args.host, args.port, args.unix, args.speed)), indent=2))
+    else:
+        print(json.dumps(asyncio.run(ask(args.host, args.port, args.unix)), indent=2))
@@ -1,13 +1,28 @@
 import csv
+import glob
+import hashlib
+import json
+import os
+import pickle
 import time
-from collections import defaultdict
+from collections import OrderedDict, defaultdict, namedtuple
+from concurrent.futures import ProcessPoolExecutor
 from enum import Enum
-from math import ceil, sqrt, trunc
+from itertools import chain, islice, repeat
+from math import ceil, isfinite, sqrt, trunc
 
-import yaml
-import matplotlib.pyplot as plt
 import numpy as np
 
+from profiling import profiled, profiler, stage
+
+# yaml and matplotlib are imported where they are first needed, so using metrics for the tables
+# and numbers (or csvs from cached trials) never loads either
+
+
+def load_yaml(text):
+    import yaml
+    return yaml.load(text, Loader=getattr(yaml, "CSafeLoader", yaml.SafeLoader))
+
 
 def use(fn, *args, **kwargs):
     def access(obj):
@@ -17,10 +32,13 @@ def use(fn, *args, **kwargs):
 
 
 def truncate(f, digits=5):
+    if not isfinite(f):
+        return f
     return trunc(f * 10 ** digits) / 10 ** digits
 
 
 # https://stackabuse.com/levenshtein-distance-and-text-similarity-in-python/
+@profiled()
 def levenshtein(seq1, seq2):
     size_x = len(seq1) + 1
     size_y = len(seq2) + 1
@@ -48,8 +66,158 @@ def levenshtein(seq1, seq2):
     return matrix[size_x - 1, size_y - 1]
 
 
-def error_rate(P, T):
-    return 100 * levenshtein(P, T) / max(len(P), len(T))
+def myers_levenshtein(seq1, seq2, max_distance=None):
+    # Hyyro's form of Myers' bit-vector algorithm: the column of the levenshtein matrix for each
+    # character of seq2 is kept as bits of vertical +1/-1 steps, one int op per step whatever the
+    # length of seq1. Once the distance can no longer come back under max_distance, returns
+    # max_distance + 1 without finishing.
+    if max_distance is not None and abs(len(seq1) - len(seq2)) > max_distance:
+        return max_distance + 1
+    if not seq1:
+        return len(seq2)
+
+    matches = defaultdict(int)
+    for i, c in enumerate(seq1):
+        matches[c] |= 1 << i
+    mask = (1 << len(seq1)) - 1
+    last = 1 << (len(seq1) - 1)
+
+    plus, minus, score = mask, 0, len(seq1)
+    for j, c in enumerate(seq2):
+        plus, minus, step = myers_step(matches.get(c, 0), plus, minus, last, mask)
+        score += step
+        if max_distance is not None and score - (len(seq2) - j - 1) > max_distance:
+            return max_distance + 1
+    return score
+
+
+def myers_step(eq, plus, minus, last, mask):
+    # one column: eq has the bits of the positions in seq1 holding this character; returns the new
+    # vertical +1/-1 bits and the change in the bottom cell, the distance so far
+    xv = eq | minus
+    xh = (((eq & plus) + plus) ^ plus) | eq
+    h_plus = minus | ~(xh | plus)
+    h_minus = plus & xh
+    step = 1 if h_plus & last else -1 if h_minus & last else 0
+    h_plus = (h_plus << 1) | 1
+    h_minus = h_minus << 1
+    return (h_minus | ~(xv | h_plus)) & mask, h_plus & xv & mask, step
+
+
+class LiveLevenshtein:
+    # distance from a fixed prompt to text typed one key at a time: each key, or a backspace, costs
+    # one myers_step (or a pop), so the distance can be scored on every keypress
+    def __init__(self, prompt):
+        self.prompt = prompt
+        self.matches = defaultdict(int)
+        for i, c in enumerate(prompt):
+            self.matches[c] |= 1 << i
+        self.mask = (1 << len(prompt)) - 1
+        self.last = 1 << max(len(prompt) - 1, 0)
+        self.states = [(self.mask, 0, len(prompt))]
+        self.typed = list()
+
+    @property
+    def distance(self):
+        return self.states[-1][2] if self.prompt else len(self.typed)
+
+    def type(self, c):
+        plus, minus, score = self.states[-1]
+        plus, minus, step = myers_step(self.matches.get(c, 0), plus, minus, self.last, self.mask)
+        self.states.append((plus, minus, score + step))
+        self.typed.append(c)
+        return self.distance
+
+    def backspace(self):
+        if self.typed:
+            self.states.pop()
+            self.typed.pop()
+        return self.distance
+
+    def key(self, key):
+        # a keypress as the trial files record it, where "\b" is backspace
+        return self.backspace() if key == "\b" else self.type(key)
+
+    def error_rate(self):
+        longest = max(len(self.prompt), len(self.typed))
+        return 100 * self.distance / longest if longest else 0.0
+
+
+def error_rate(P, T, distance=levenshtein, max_distance=None):
+    # distance is levenshtein, the reference, or myers_levenshtein, which gives the same numbers. With
+    # max_distance, myers_levenshtein stops early and the result is capped: inf when the distance is
+    # over max_distance, so only comparisons against a threshold are meaningful past the cutoff. The
+    # cutoff is myers_levenshtein's own, so it can't be combined with another distance.
+    if max_distance is None:
+        return 100 * distance(P, T) / max(len(P), len(T))
+    if distance not in (levenshtein, myers_levenshtein):
+        raise ValueError("max_distance needs distance=myers_levenshtein")
+    found = myers_levenshtein(P, T, max_distance)
+    return 100 * found / max(len(P), len(T)) if found <= max_distance else float("inf")
+
+
+def within_error_rate(P, T, limit):
+    # whether the error rate is at most limit percent, stopping as soon as the distance can't get there
+    longest = max(len(P), len(T))
+    cutoff = int(limit * longest / 100)
+    # a distance of cutoff + 1 comes back exact, which settles the rounding of limit * longest / 100
+    return 100 * myers_levenshtein(P, T, cutoff) / longest <= limit if longest else True
+
+
+def pad_codes(strings, fill=-1):
+    # one row of code points per string, padded out to the longest with fill
+    lengths = np.fromiter(map(len, strings), dtype=np.int64, count=len(strings))
+    codes = np.full((len(strings), lengths.max(initial=0)), fill, dtype=np.int32)
+    flat = np.frombuffer(''.join(strings).encode('utf-32-le'), dtype='<u4')
+    rows = np.repeat(np.arange(len(strings)), lengths)
+    cols = np.arange(len(flat)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    codes[rows, cols] = flat
+    return codes, lengths
+
+
+@profiled()
+def batch_levenshtein(pairs):
+    # same recurrence as levenshtein, but one numpy row update per character of the
+    # longest first string covers every pair at once; the insertion term along a row
+    # is a running minimum of (candidate - column) shifted back by column
+    pairs = list(pairs)
+    if not pairs:
+        return np.zeros(0, dtype=np.int16)
+
+    a, len_a = pad_codes([p for p, _ in pairs], fill=-1)
+    b, len_b = pad_codes([t for _, t in pairs], fill=-2)
+    longest = max(a.shape[1], b.shape[1])
+    dtype = np.int16 if 2 * longest < np.iinfo(np.int16).max else np.int32
+
+    # longest first strings first, so the pairs still being filled are always a prefix
+    order = np.argsort(-len_a, kind='stable')
+    a, len_a, b, len_b = a[order], len_a[order], b[order], len_b[order]
+
+    cols = np.arange(b.shape[1] + 1, dtype=dtype)
+    row = np.tile(cols, (len(pairs), 1))
+    out = np.empty(len(pairs), dtype=dtype)
+    active = len(pairs)
+    for x in range(a.shape[1] + 1):
+        while active and len_a[active - 1] == x:
+            active -= 1
+            out[active] = row[active, len_b[active]]
+        if not active:
+            break
+        row = row[:active]
+        cand = np.empty_like(row)
+        cand[:, 0] = x + 1
+        np.minimum(row[:, :-1] + (a[:active, x, None] != b[:active]), row[:, 1:] + 1, out=cand[:, 1:])
+        row = np.minimum.accumulate(cand - cols, axis=1) + cols
+
+    distances = np.empty_like(out)
+    distances[order] = out
+    return distances
+
+
+def batch_error_rates(pairs):
+    pairs = list(pairs)
+    longest = np.array([max(len(P), len(T)) for P, T in pairs], dtype=np.int64)
+    return 100 * batch_levenshtein(pairs).astype(np.float64) / longest
 
 
 class Layouts(Enum):
@@ -67,17 +235,90 @@ def layout_name(l):
                 Layouts.TiltType: Layouts.TiltType.value, Layouts.Raycast: 'Controller Pointing'}[l]
 
 
-trial_files = {0: "trial-2020-07-16_02-36-27.yaml", 1: "trial-2020-07-16_02-46-22.yaml",
-               2: "trial-2020-07-16_03-13-40.yaml", 3: "trial-2020-07-16_03-36-35.yaml"}
+results_dir = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "Results"))
+trial_cache_name = ".trial-cache"
+
+
+def discover_trials(directory=results_dir):
+    return sorted(glob.glob(os.path.join(directory, "**", "trial-*.yaml"), recursive=True))
+
+
+def get_all_trials(directory=results_dir):
+    return {os.path.relpath(path, directory): read_trial(path) for path in discover_trials(directory)}
 
 
-def get_all_trials():
-    return {v: get_trial(k) for k, v in trial_files.items()}
+def get_trial(n=0, directory=results_dir):
+    return read_trial(discover_trials(directory)[n])
 
 
-def get_trial(n=0):
-    with open("../../Results/" + trial_files[n]) as yams:
-        return yaml.load(yams, Loader=yaml.UnsafeLoader)
+def read_trial(path, use_cache=True):
+    # parsed trials are pickled under the sha1 of the yaml (in a .trial-cache directory next to the file),
+    # so an unchanged file is never parsed twice
+    with open(path, 'rb') as yams:
+        raw = yams.read()
+    if not use_cache:
+        with stage("yaml"):
+            return load_yaml(raw)
+
+    cache_dir = os.path.join(os.path.dirname(path), trial_cache_name)
+    cached = os.path.join(cache_dir, hashlib.sha1(raw).hexdigest() + ".pickle")
+    try:
+        with open(cached, 'rb') as pickled, stage("unpickle"):
+            return pickle.load(pickled)
+    except (OSError, EOFError, pickle.UnpicklingError):
+        pass
+
+    with stage("yaml"):
+        trial = load_yaml(raw)
+    os.makedirs(cache_dir, exist_ok=True)
+    partial = cached + ".%d.tmp" % os.getpid()
+    with open(partial, 'wb') as pickled:
+        pickle.dump(trial, pickled, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(partial, cached)
+    return trial
+
+
+def iter_trial(path):
+    # yields the items of a trial's top-level "trial:" list one at a time; the list is cut on its
+    # "- " item markers and each item is parsed on its own, so at most one challenge's keypresses
+    # are in memory. Files not written in that block layout are loaded whole instead.
+    marker, block = None, None
+    with open(path, encoding='utf-8') as yams:
+        for line in yams:
+            if block is None:
+                if line.rstrip() == "trial:":
+                    block = []
+                continue
+            if marker is None and line.lstrip().startswith("- "):
+                marker = line[:len(line) - len(line.lstrip())] + "- "
+            if line.startswith(marker or "- ") and block:
+                yield from load_yaml("".join(block))
+                block = []
+            elif line.strip() and not line[0].isspace() and not line.startswith("- "):
+                break
+            block.append(line)
+
+    if block is None:
+        yield from read_trial(path)["trial"]
+    elif block:
+        yield from load_yaml("".join(block)) or []
+
+
+def iter_recording(path):
+    # yields (time, values) from a flat "time: value" recording such as RecordedData/stylus-output-*.yaml,
+    # one line at a time. values is always a list: [value] for a number, [x, y, z] for a list. Lines
+    # that aren't samples are skipped.
+    with open(path, encoding='utf-8') as yams:
+        for line in yams:
+            key, sep, value = line.partition(":")
+            value = value.strip()
+            if not sep or not key.strip():
+                continue
+            try:
+                yield float(key), [float(v) for v in value.strip("[]").split(",")] if value.startswith("[") \
+                    else [float(value)]
+            except ValueError:
+                continue
 
 
 def print_yaml_recur(yams, indent=0):
@@ -102,19 +343,14 @@ def randrange(n, vmin, vmax):
     return (vmax - vmin) * np.random.rand(n) + vmin
 
 
-def extract_layout_positions(data: dict, layout, use_practice=False):
-    out = list()
-    for item in data["trial"]:
-        try:
-            challenge = item["challenge"]
-            if challenge["layout"] == layout and (not use_practice or not challenge['type'] == 'Practice'):
-                for kp in item["challenge"]["keypresses"].values():
-                    out.append(kp["pressPos"])
-        except KeyError:
-            pass
-        except AttributeError:
-            pass
-    return out
+@profiled()
+def extract_layout_positions(challenges, keypresses, layout, use_practice=False):
+    owner = challenges[keypresses["challenge"]]
+    keep = owner["layout"] == layout
+    if use_practice:
+        keep &= owner["type"] != 'Practice'
+    posses = keypresses["press_pos"][keep]
+    return posses[~np.isnan(posses).any(axis=1)]
 
 
 def merge_trials(*datas):
@@ -124,6 +360,84 @@ def merge_trials(*datas):
     return {"meta": "lost in merge", "trial": out}
 
 
+challenge_dtype = np.dtype([("session", np.int32), ("layout", "U16"), ("type", "U16"), ("prompt", object),
+                            ("output", object), ("start", np.float64), ("stop", np.float64),
+                            ("duration", np.float64)])
+keypress_dtype = np.dtype([("challenge", np.int32), ("time", np.float64), ("key", "U8"), ("pos", np.float64, 3),
+                           ("rot", np.float64, 3), ("press_pos", np.float32, 3)])
+
+
+@profiled()
+def trial_tables(*trials):
+    # flattens trials into one row per challenge and one row per keypress (keypresses point back at
+    # their challenge's row); travel or pressPos missing from a keypress is left as nan
+    found = [(session, item["challenge"]) for session, trial in enumerate(trials) for item in trial["trial"]
+             if "challenge" in item]
+    challenges = np.empty(len(found), dtype=challenge_dtype)
+    challenges["session"] = [session for session, _ in found]
+    for field in ("layout", "type", "prompt", "output"):
+        challenges[field] = [c[field] for _, c in found]
+    for field in ("start", "stop", "duration"):
+        challenges[field] = [c["time"][field] for _, c in found]
+
+    presses = [(i, t, kp) for i, (_, c) in enumerate(found) for t, kp in (c["keypresses"] or {}).items()]
+    keypresses = np.empty(len(presses), dtype=keypress_dtype)
+    keypresses["challenge"] = [i for i, _, _ in presses]
+    keypresses["time"] = [t for _, t, _ in presses]
+    keypresses["key"] = [kp.get("key", "") for _, _, kp in presses]
+
+    unknown = [np.nan] * 3
+    vectors = {"pos": lambda kp: (kp.get("travel") or {}).get("pos", unknown),
+               "rot": lambda kp: (kp.get("travel") or {}).get("rot", unknown),
+               "press_pos": lambda kp: kp.get("pressPos", unknown)}
+    for field, vector in vectors.items():
+        values = chain.from_iterable(vector(kp) for _, _, kp in presses)
+        keypresses[field] = np.fromiter(values, dtype=keypress_dtype[field].base,
+                                        count=3 * len(presses)).reshape(-1, 3)
+    return challenges, keypresses
+
+
+def file_tables(path):
+    return trial_tables(read_trial(path))
+
+
+def merge_tables(parts):
+    # each part is one session's (challenges, keypresses); sessions are renumbered in order and
+    # keypresses re-pointed at their challenge's row in the merged table
+    offsets = np.cumsum([0] + [len(challenges) for challenges, _ in parts])
+    challenges = np.concatenate([c for c, _ in parts] or [np.empty(0, dtype=challenge_dtype)])
+    keypresses = np.concatenate([k for _, k in parts] or [np.empty(0, dtype=keypress_dtype)])
+    challenges["session"] = np.repeat(np.arange(len(parts)), np.diff(offsets))
+    keypresses["challenge"] += np.repeat(offsets[:-1], [len(k) for _, k in parts]).astype(np.int32)
+    return challenges, keypresses
+
+
+def map_files(fn, paths, workers=None, *args):
+    # workers=None uses every core, workers=1 (or a single file) runs serially in this process
+    workers = os.cpu_count() if workers is None else workers
+    if workers > 1 and len(paths) > 1:
+        with ProcessPoolExecutor(max_workers=min(workers, len(paths))) as pool:
+            return list(pool.map(fn, paths, *(repeat(arg) for arg in args)))
+    return [fn(path, *args) for path in paths]
+
+
+@profiled()
+def load_tables(paths, workers=None):
+    return merge_tables(map_files(file_tables, paths, workers))
+
+
+@profiled()
+def group_by(keys, values):
+    # groups come out in order of first appearance, each keeping its rows in their original order
+    groups, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+    appearance = np.argsort(first)
+    rank = np.empty_like(appearance)
+    rank[appearance] = np.arange(len(appearance))
+    order = np.argsort(rank[inverse], kind='stable')
+    bounds = np.cumsum(np.bincount(rank[inverse], minlength=len(groups)))[:-1]
+    return dict(zip(groups[appearance].tolist(), np.split(values[order], bounds)))
+
+
 arctype_x_range_size = 145 - 45
 tilttype_x_range_size = 30 - 5
 tilttype_z_range_size = 30 - -10
@@ -141,7 +455,7 @@ def tilttype_pos(c: str):
 def raycast_pos(c: str):
     for i, row in enumerate(['QWERTYUIOP', 'ASDFGHJKL;', 'ZXCVBNM,. ']):
         if c.upper() in row:
-            return row.find(c), i
+            return row.find(c.upper()), i
 
 
 def raycast_displacement(p, c, signed=False):
@@ -196,6 +510,252 @@ def tilttype_ideal(prompt: str):
     return sqrt(a * a + b * b)
 
 
+slider_only_keys = "ABCDEFGHIJKLMNOPQRSTUVWXYZ \b"
+slider_only_widths = [3, 2, 2, 2, 3, 2, 2, 2, 3, 2, 2, 2, 2, 3, 3, 2, 2, 3, 2, 3, 2, 2, 2, 2, 2, 2, 3, 3]
+
+
+def slider_only_pos(c: str):
+    i = slider_only_keys.find(c.upper())
+    if len(c) != 1 or i < 0:
+        raise ValueError()
+    return sum(slider_only_widths[:i]) + slider_only_widths[i] / 2, 0
+
+
+def layout_table(pos):
+    # character code -> key coordinates, nan where the layout has no key for that character
+    table = np.full((256, 2), np.nan)
+    for code in range(128):
+        try:
+            found = pos(chr(code))
+        except ValueError:
+            continue
+        if found is not None:
+            table[code] = found
+    return table
+
+
+layout_tables = {
+    Layouts.SliderOnly.value: layout_table(slider_only_pos),
+    Layouts.ArcType.value: layout_table(lambda c: (arctype_bin(c), 0)),
+    Layouts.TiltType.value: layout_table(tilttype_pos),
+    Layouts.Raycast.value: layout_table(raycast_pos),
+}
+# table units -> degrees of ideal travel along each axis; keys without a known range stay in key units
+travel_scales = {
+    Layouts.SliderOnly.value: np.array([1, 0]),
+    Layouts.ArcType.value: np.array([arctype_x_range_size / ceil(26 / 4), 0]),
+    Layouts.TiltType.value: np.array([tilttype_x_range_size / ceil(26 / 4), tilttype_z_range_size / 4]),
+    Layouts.Raycast.value: np.array([1, 1]),
+}
+
+
+def prompt_codes(prompts):
+    lengths = np.fromiter(map(len, prompts), dtype=np.int64, count=len(prompts))
+    codes = np.frombuffer(''.join(prompts).encode('latin-1', errors='replace'), dtype=np.uint8)
+    return codes, lengths
+
+
+def batch_ideal_displacement(layout, prompts):
+    # per prompt, the summed |step| between consecutive keys along each axis, scaled by travel_scales;
+    # all prompts are looked up and diffed together, and the steps between prompts are dropped
+    prompts = list(prompts)
+    codes, lengths = prompt_codes(prompts)
+    steps = np.abs(np.diff(layout_tables[layout][codes], axis=0)) * travel_scales[layout]
+    owner = np.repeat(np.arange(len(prompts)), lengths)
+    within = owner[1:] == owner[:-1]
+    steps, owner = steps[within], owner[1:][within]
+    if np.isnan(steps).any():
+        raise ValueError("prompt has a character with no key in " + layout)
+    return np.column_stack([np.bincount(owner, weights=steps[:, axis], minlength=len(prompts))
+                            for axis in range(2)])
+
+
+@profiled()
+def batch_ideal_travel(layout, prompts):
+    x, z = batch_ideal_displacement(layout, prompts).T
+    return np.sqrt(x * x + z * z)
+
+
+phrases_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "MacKenzie2.txt")
+CacheInfo = namedtuple("CacheInfo", ["hits", "misses", "maxsize", "currsize"])
+
+
+class IdealTravelCache:
+    # LRU of per-axis ideal displacement keyed by (layout, prompt); the same phrase set is typed by
+    # every participant, so after the first session nearly every lookup is a hit
+    def __init__(self, maxsize=4096):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def displacement(self, layout, prompts):
+        prompts = list(prompts)
+        out = np.empty((len(prompts), 2))
+        missing = dict()
+        for i, prompt in enumerate(prompts):
+            found = self._entries.get((layout, prompt))
+            if found is not None:
+                self._entries.move_to_end((layout, prompt))
+                out[i] = found
+                self.hits += 1
+            elif prompt in missing:
+                missing[prompt].append(i)
+                self.hits += 1
+            else:
+                missing[prompt] = [i]
+                self.misses += 1
+
+        for prompt, found in zip(missing, batch_ideal_displacement(layout, missing)):
+            out[missing[prompt]] = found
+            self._store((layout, prompt), found)
+        return out
+
+    def travel(self, layout, prompts):
+        x, z = self.displacement(layout, prompts).T
+        return np.sqrt(x * x + z * z)
+
+    def precompute(self, prompts, layouts=(Layouts.ArcType.value, Layouts.TiltType.value)):
+        # fills the cache without touching the hit/miss counters; prompts a layout has no keys for are skipped
+        prompts = list(dict.fromkeys(prompts))
+        for layout in layouts:
+            known = [p for p in prompts if not np.isnan(layout_tables[layout][prompt_codes([p])[0]]).any()]
+            for prompt, found in zip(known, batch_ideal_displacement(layout, known)):
+                self._store((layout, prompt), found)
+
+    def precompute_phrases(self, path=phrases_path, **kwargs):
+        with open(path) as phrases:
+            self.precompute((line.strip().upper() for line in phrases if line.strip()), **kwargs)
+
+    def info(self):
+        return CacheInfo(self.hits, self.misses, self.maxsize, len(self._entries))
+
+    def clear(self):
+        self._entries.clear()
+        self.hits = self.misses = 0
+
+    def _store(self, key, value):
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+
+ideal_travel_cache = IdealTravelCache()
+
+# edit operations of an alignment, and the classes errors are sorted into
+MATCH, SUBSTITUTION, INSERTION, DELETION = range(4)
+error_classes = ("dipped", "off-by-one", "row shift", "column shift", "other substitution", "unknown key",
+                 "insertion", "deletion")
+alignment_dtype = np.dtype([("pair", np.int64), ("op", np.int8), ("prompt", np.int32), ("output", np.int32)])
+# the key grid substitutions are measured on; ArcType is measured on TiltType's grid, as it always has been
+error_tables = dict(layout_tables, **{Layouts.ArcType.value: layout_tables[Layouts.TiltType.value]})
+
+
+def batch_alignment(pairs, chunk_size=2048):
+    # one row per edit operation turning each prompt into its output, pairs in order and each pair's
+    # operations from its start: prompt and output hold the character codes involved, -1 for the side
+    # an insertion or deletion leaves empty. The full levenshtein matrices of a chunk of pairs are
+    # filled row by row as in batch_levenshtein, then every pair's backtrace steps together, preferring
+    # the diagonal, then a deletion, then an insertion.
+    pairs = list(pairs)
+    parts = [np.empty(0, dtype=alignment_dtype)]
+    for first in range(0, len(pairs), chunk_size):
+        parts.append(_chunk_alignment(pairs[first:first + chunk_size], first))
+    return np.concatenate(parts)
+
+
+def _chunk_alignment(pairs, offset):
+    a, len_a = pad_codes([p for p, _ in pairs], fill=-1)
+    b, len_b = pad_codes([t for _, t in pairs], fill=-2)
+    dtype = np.int16 if 2 * max(a.shape[1], b.shape[1]) < np.iinfo(np.int16).max else np.int32
+    cols = np.arange(b.shape[1] + 1, dtype=dtype)
+    matrix = np.empty((len(pairs), a.shape[1] + 1, b.shape[1] + 1), dtype=dtype)
+    matrix[:, 0] = cols
+    for x in range(a.shape[1]):
+        row = matrix[:, x]
+        cand = np.empty_like(row)
+        cand[:, 0] = x + 1
+        np.minimum(row[:, :-1] + (a[:, x, None] != b), row[:, 1:] + 1, out=cand[:, 1:])
+        matrix[:, x + 1] = np.minimum.accumulate(cand - cols, axis=1) + cols
+
+    # pad one column of gaps on the left, so index i - 1 (or j - 1) of 0 reads -1 instead of wrapping
+    a = np.column_stack((np.full(len(pairs), -1, dtype=a.dtype), a))
+    b = np.column_stack((np.full(len(pairs), -1, dtype=b.dtype), b))
+    rows = np.arange(len(pairs))
+    i, j = len_a.copy(), len_b.copy()
+    steps = list()
+    while True:
+        live = np.flatnonzero((i > 0) | (j > 0))
+        if not len(live):
+            break
+        r, ii, jj = rows[live], i[live], j[live]
+        here = matrix[r, ii, jj]
+        ca, cb = a[r, ii], b[r, jj]
+        diagonal = (ii > 0) & (jj > 0) & (matrix[r, ii - 1, jj - 1] + (ca != cb) == here)
+        deletion = ~diagonal & (ii > 0) & (matrix[r, ii - 1, jj] + 1 == here)
+        insertion = ~diagonal & ~deletion
+
+        step = np.empty(len(live), dtype=alignment_dtype)
+        step["pair"] = r + offset
+        step["op"] = np.where(diagonal, np.where(ca == cb, MATCH, SUBSTITUTION),
+                              np.where(deletion, DELETION, INSERTION))
+        step["prompt"] = np.where(insertion, -1, ca)
+        step["output"] = np.where(deletion, -1, cb)
+        steps.append(step)
+        i[live] -= diagonal | deletion
+        j[live] -= diagonal | insertion
+
+    # steps came out last operation first; a stable sort on pair puts each pair back in order
+    aligned = np.concatenate(steps[::-1] or [np.empty(0, dtype=alignment_dtype)])
+    return aligned[np.argsort(aligned["pair"], kind='stable')]
+
+
+def classify_errors(layout, aligned):
+    # an error class index (into error_classes) per row of an alignment, -1 for matches. Substitutions
+    # are placed by the displacement between the prompt's key and the key typed on error_tables[layout]:
+    # one row down is dipped, any other single step is off-by-one, further along only the row or the
+    # column is a row or column shift
+    table = error_tables[layout]
+    prompt = table[np.where((aligned["prompt"] >= 0) & (aligned["prompt"] < 256), aligned["prompt"], 0)]
+    output = table[np.where((aligned["output"] >= 0) & (aligned["output"] < 256), aligned["output"], 0)]
+    dx, dy = (prompt - output).T
+
+    classes = np.full(len(aligned), error_classes.index("other substitution"), dtype=np.int8)
+    classes[(dx == 0) & (dy != 0)] = error_classes.index("row shift")
+    classes[(dy == 0) & (dx != 0)] = error_classes.index("column shift")
+    classes[np.abs(dx) + np.abs(dy) == 1] = error_classes.index("off-by-one")
+    classes[(dx == 0) & (dy == -1)] = error_classes.index("dipped")
+    classes[np.isnan(dx) | np.isnan(dy)] = error_classes.index("unknown key")
+    classes[aligned["op"] == INSERTION] = error_classes.index("insertion")
+    classes[aligned["op"] == DELETION] = error_classes.index("deletion")
+    classes[aligned["op"] == MATCH] = -1
+    return classes
+
+
+def error_breakdown(layout_pairs):
+    # {layout: counts per error class} over every (prompt, output) pair of each layout
+    breakdown = dict()
+    for layout, pairs in layout_pairs.items():
+        classes = classify_errors(layout, batch_alignment(pairs))
+        breakdown[layout] = np.bincount(classes[classes >= 0], minlength=len(error_classes))
+    return breakdown
+
+
+def confusion_matrix(aligned):
+    # (labels, counts): counts[p, o] is how often prompt character labels[p] came out as labels[o],
+    # where the label "" stands for the gap of an insertion (as p) or a deletion (as o)
+    codes = np.concatenate((aligned["prompt"], aligned["output"]))
+    labels, inverse = np.unique(codes, return_inverse=True)
+    counts = np.zeros((len(labels), len(labels)), dtype=np.int64)
+    np.add.at(counts, (inverse[:len(aligned)], inverse[len(aligned):]), 1)
+    return ["" if code < 0 else chr(code) for code in labels.tolist()], counts
+
+
+def layout_confusion_matrices(layout_pairs):
+    return {layout: confusion_matrix(batch_alignment(pairs)) for layout, pairs in layout_pairs.items()}
+
+
 def challenge_rot_travel(challenge):
     out = 0
     for kp in challenge['keypresses'].values():
@@ -223,53 +783,357 @@ def accurate_words_per_minutes(challenge):
     return a * words_per_minute(challenge)
 
 
+@profiled()
+def table_rot_travel(challenges, keypresses):
+    rot = np.nan_to_num(keypresses["rot"])
+    norms = np.sqrt(rot[:, 0] * rot[:, 0] + rot[:, 1] * rot[:, 1] + rot[:, 2] * rot[:, 2])
+    return np.bincount(keypresses["challenge"], weights=norms, minlength=len(challenges))
+
+
+@profiled()
+def table_words_per_minute(challenges):
+    interval = challenges["duration"]
+    assert (interval > 0).all()
+    minutes_of_entry = interval / 60
+    words_entered = np.maximum(0, np.fromiter(map(len, challenges["output"]), dtype=np.int64) - 1) / 5
+    return words_entered / minutes_of_entry
+
+
+@profiled()
+def table_accurate_words_per_minute(challenges):
+    prompts, prompt_lengths = pad_codes(challenges["prompt"].tolist(), fill=-1)
+    outputs, _ = pad_codes(challenges["output"].tolist(), fill=-2)
+    width = min(prompts.shape[1], outputs.shape[1])
+    a = (prompts[:, :width] == outputs[:, :width]).sum(axis=1) / prompt_lengths
+    return a * table_words_per_minute(challenges)
+
+
+interval_dtype = np.dtype([("challenge", np.int32), ("interval", np.float64), ("first", "U8"), ("second", "U8")])
+bigram_dtype = np.dtype([("layout", "U16"), ("bigram", "U16"), ("count", np.int64), ("mean", np.float64),
+                         ("median", np.float64), ("std", np.float64)])
+
+
+def sorted_keypresses(keypresses):
+    # keypresses grouped by challenge, each challenge's in time order
+    return keypresses[np.lexsort((keypresses["time"], keypresses["challenge"]))]
+
+
+def inter_key_intervals(keypresses):
+    # one row per consecutive pair of keypresses within a challenge: the time between them and both keys
+    ordered = sorted_keypresses(keypresses)
+    same = ordered["challenge"][1:] == ordered["challenge"][:-1]
+    intervals = np.empty(np.count_nonzero(same), dtype=interval_dtype)
+    intervals["challenge"] = ordered["challenge"][1:][same]
+    intervals["interval"] = np.diff(ordered["time"])[same]
+    intervals["first"] = ordered["key"][:-1][same]
+    intervals["second"] = ordered["key"][1:][same]
+    return intervals
+
+
+def group_medians(groups, values, n):
+    # median of values per group 0..n-1 (nan for empty groups) from one sort
+    order = np.lexsort((values, groups))
+    counts = np.bincount(groups, minlength=n)
+    starts = np.cumsum(counts) - counts
+    ordered = np.append(values[order], np.nan)
+    low = np.where(counts > 0, starts + (counts - 1) // 2, len(values))
+    high = np.where(counts > 0, starts + counts // 2, len(values))
+    return (ordered[low] + ordered[high]) / 2
+
+
+def first_key_latency(challenges, keypresses):
+    # time from each challenge's start to its first keypress, nan for challenges with no keypresses
+    first = np.full(len(challenges), np.inf)
+    np.minimum.at(first, keypresses["challenge"], keypresses["time"])
+    return np.where(np.isfinite(first), first - challenges["start"], np.nan)
+
+
+def detect_pauses(intervals, n, threshold=None, factor=3):
+    # an interval is a pause when it is longer than threshold seconds or, with no threshold, longer
+    # than factor times its challenge's median interval. Returns the mask and, per challenge, the
+    # number of pauses and the time spent in them.
+    if threshold is None:
+        limit = factor * group_medians(intervals["challenge"], intervals["interval"], n)[intervals["challenge"]]
+    else:
+        limit = threshold
+    paused = intervals["interval"] > limit
+    return (paused, np.bincount(intervals["challenge"][paused], minlength=n),
+            np.bincount(intervals["challenge"], weights=np.where(paused, intervals["interval"], 0), minlength=n))
+
+
+def bigram_latencies(challenges, intervals, min_count=1):
+    # count, mean, median and std of the interval before each key, per layout and pair of keys
+    layouts = challenges["layout"][intervals["challenge"]]
+    keys, inverse = np.unique(np.column_stack((layouts, np.char.add(intervals["first"], intervals["second"]))),
+                              axis=0, return_inverse=True)
+    inverse = inverse.ravel()
+    counts = np.bincount(inverse, minlength=len(keys))
+    sums = np.bincount(inverse, weights=intervals["interval"], minlength=len(keys))
+    squares = np.bincount(inverse, weights=intervals["interval"] ** 2, minlength=len(keys))
+
+    table = np.empty(len(keys), dtype=bigram_dtype)
+    table["layout"], table["bigram"], table["count"] = keys[:, 0], keys[:, 1], counts
+    with np.errstate(invalid='ignore', divide='ignore'):
+        table["mean"] = sums / counts
+        table["std"] = np.sqrt(np.maximum(squares / counts - table["mean"] ** 2, 0))
+    table["median"] = group_medians(inverse, intervals["interval"], len(keys))
+    return table[table["count"] >= min_count]
+
+
+@profiled()
+def keypress_timing(challenges, keypresses, skip_practice=True, pause_threshold=None, pause_factor=3):
+    # the timing of every keypress in the tables, per layout: inter-key intervals, first-key
+    # latencies, pauses per challenge and the bigram latency table
+    counted = challenges["type"] != 'Practice' if skip_practice else np.ones(len(challenges), dtype=bool)
+    intervals = inter_key_intervals(keypresses[counted[keypresses["challenge"]]])
+    latency = first_key_latency(challenges, keypresses)
+    paused, pauses, pause_time = detect_pauses(intervals, len(challenges), pause_threshold, pause_factor)
+    layouts = challenges["layout"]
+    return {
+        "layout_iki": group_by(layouts[intervals["challenge"]], intervals["interval"]),
+        "layout_first_key": group_by(layouts[counted], latency[counted]),
+        "layout_pauses": group_by(layouts[counted], np.column_stack((pauses, pause_time))[counted]),
+        "paused": paused,
+        "bigrams": bigram_latencies(challenges, intervals),
+    }
+
+
+def iki_distribution(intervals, bins=50, limit=None):
+    # histogram of intervals up to limit (their 99th percentile by default), as counts and bin edges
+    limit = np.percentile(intervals, 99) if limit is None and len(intervals) else limit or 1
+    return np.histogram(intervals, bins=bins, range=(0, limit))
+
+
 # https://stackoverflow.com/questions/11686720/is-there-a-numpy-builtin-to-reject-outliers-from-a-list
+@profiled()
 def reject_outliers(data, m=2):
     return data[abs(data - np.mean(data)) < m * np.std(data)]
 
 
-def make_point_cloud(data):
-    fig = plt.figure()
+class RunningStats:
+    # count, mean and variance of a stream of values in constant memory. Batches and other
+    # RunningStats are folded in with Chan et al.'s pairwise form of Welford's update, so per-file or
+    # per-worker stats merge to the same answer as one pass over everything.
+    def __init__(self, count=0, mean=0.0, m2=0.0):
+        self.count = count
+        self._mean = mean
+        self.m2 = m2
+
+    def add(self, values, weights=None):
+        values = np.asarray(values, dtype=np.float64).ravel()
+        weights = np.ones(len(values)) if weights is None else np.asarray(weights, dtype=np.float64).ravel()
+        count = weights.sum()
+        if count:
+            mean = np.dot(weights, values) / count
+            self.merge(RunningStats(count, mean, np.dot(weights, (values - mean) ** 2)))
+        return self
+
+    def merge(self, other):
+        count = self.count + other.count
+        if other.count:
+            delta = other._mean - self._mean
+            self._mean += delta * other.count / count
+            self.m2 += other.m2 + delta ** 2 * self.count * other.count / count
+            self.count = count
+        return self
+
+    @property
+    def mean(self):
+        return self._mean if self.count else np.nan
+
+    @property
+    def var(self):
+        return self.m2 / self.count if self.count else np.nan
+
+    @property
+    def std(self):
+        return sqrt(self.var)
+
+    def within(self, values, m=2):
+        # second pass of reject_outliers: the values closer than m stds to the mean seen in the first
+        values = np.asarray(values, dtype=np.float64)
+        return values[abs(values - self.mean) < m * self.std]
+
+
+class QuantileSketch:
+    # mergeable histogram of values in logarithmic buckets, each within accuracy (relative) of the
+    # values it holds, so quantiles, the median and MAD come out in memory that grows only with the
+    # log of the range of the data
+    def __init__(self, accuracy=0.01):
+        self.accuracy = accuracy
+        self.gamma = (1 + accuracy) / (1 - accuracy)
+        self.counts = defaultdict(int)
+
+    def add(self, values):
+        values = np.asarray(values, dtype=np.float64).ravel()
+        values = values[np.isfinite(values)]
+        magnitude = np.abs(values)
+        buckets = np.zeros(len(values), dtype=np.int64)
+        nonzero = magnitude > 0
+        buckets[nonzero] = np.ceil(np.log(magnitude[nonzero]) / np.log(self.gamma))
+        keys, counts = np.unique(np.column_stack((np.sign(values).astype(np.int64), buckets)), axis=0,
+                                 return_counts=True)
+        for (sign, bucket), count in zip(keys.tolist(), counts.tolist()):
+            self.counts[sign, bucket] += count
+        return self
+
+    def merge(self, other):
+        for key, count in other.counts.items():
+            self.counts[key] += count
+        return self
+
+    def histogram(self):
+        # bucket representatives in ascending order, with their counts
+        keys = sorted(self.counts, key=lambda k: (k[0], k[0] * k[1]))
+        values = np.array([sign * 2 * self.gamma ** bucket / (self.gamma + 1) for sign, bucket in keys])
+        return values, np.array([self.counts[k] for k in keys], dtype=np.float64)
+
+    @staticmethod
+    def _quantile(values, counts, q):
+        if not len(values):
+            return np.nan
+        cumulative = np.cumsum(counts)
+        return values[np.searchsorted(cumulative, q * cumulative[-1])]
+
+    def quantile(self, q):
+        return self._quantile(*self.histogram(), q)
+
+    def median(self):
+        return self.quantile(0.5)
+
+    def mad(self):
+        values, counts = self.histogram()
+        deviations = np.abs(values - self._quantile(values, counts, 0.5))
+        order = np.argsort(deviations, kind='stable')
+        return self._quantile(deviations[order], counts[order], 0.5)
+
+    def trimmed(self, m=2):
+        # RunningStats of the values within m scaled MADs (comparable to m stds for normal data) of
+        # the median, taken from the buckets alone, so no second pass over the data is needed
+        values, counts = self.histogram()
+        keep = abs(values - self._quantile(values, counts, 0.5)) <= m * 1.4826 * self.mad()
+        return RunningStats().add(values[keep], counts[keep])
+
+
+figures_dir = os.path.join(results_dir, "Figures")
+
+
+def new_figure(show=True):
+    # figures that will be shown go through pyplot; headless ones are bare Figures, which save through
+    # Agg and never touch pyplot's global state
+    if show:
+        import matplotlib.pyplot as plt
+        return plt.figure()
+    from matplotlib.figure import Figure
+    return Figure()
+
+
+def finish_figure(fig, name, show=True, directory=figures_dir):
+    path = os.path.join(directory, name)
+    fig.savefig(path, transparent=True)
+    if show:
+        import matplotlib.pyplot as plt
+        plt.show()
+    return path
+
+
+def cloud_bounds(point_sets):
+    # shared extent of every set along each axis, widened where it is flat so histograms get a range
+    every = np.concatenate(point_sets)
+    return [(lo, hi if hi > lo else lo + 1) for lo, hi in zip(every.min(axis=0), every.max(axis=0))]
+
+
+def sample_points(points, k, seed=0):
+    # k rows picked uniformly without replacement, so an overlay costs the same however many there are
+    if len(points) <= k:
+        return points
+    rng = np.random.default_rng(seed)
+    return points[np.sort(rng.choice(len(points), k, replace=False))]
+
+
+def voxel_counts(points, bins, bounds):
+    # histogram of points over a fixed grid; returns the centres and counts of the occupied cells only
+    counts, edges = np.histogramdd(points, bins=bins, range=bounds)
+    occupied = np.nonzero(counts)
+    centres = [(e[:-1] + e[1:])[i] / 2 for e, i in zip(edges, occupied)]
+    return centres, counts[occupied]
+
+
+@profiled()
+def make_point_cloud(data, show=True, directory=figures_dir, density=False, bins=24, overlay=0, seed=0):
+    # density bins the positions into a bins^3 grid and draws one marker per occupied cell, sized by
+    # its count, so the cost follows the grid and not the keypresses; overlay adds that many sampled points
+    fig = new_figure(show)
     ax = fig.add_subplot(111, projection='3d')
 
-    for layout, marker in zip((e.value for e in Layouts), ['o', '^', '.', 's']):
-        posses = data.layout_posses[layout]
-        if not posses or layout == Layouts.SliderOnly.value:
-            continue
-
-        xs = [v[0] for v in posses]
-        ys = [v[1] for v in posses]
-        zs = [v[2] for v in posses]
-        ax.scatter(xs, zs, ys, marker=marker)
+    shown = [(e.value, data.layout_posses[e.value], marker) for e, marker in zip(Layouts, ['o', '^', '.', 's'])
+             if e != Layouts.SliderOnly and len(data.layout_posses[e.value])]
+    if density and shown:
+        # the grid spans the positions themselves; a fixed box would drop whole layouts outside it
+        bounds = cloud_bounds([posses[:, [0, 2, 1]] for _, posses, _ in shown])
+
+    handles = list()
+    for layout, posses, marker in shown:
+        if density:
+            (xs, zs, ys), counts = voxel_counts(posses[:, [0, 2, 1]], bins, bounds)
+            sizes = 4 + 96 * counts / max(counts.max(initial=0), 1)
+            colour = 'C%d' % len(handles)
+            handles.append(ax.scatter(xs, zs, ys, marker=marker, s=sizes, alpha=0.6, color=colour))
+            if overlay:
+                sampled = sample_points(posses, overlay, seed)
+                ax.scatter(sampled[:, 0], sampled[:, 2], sampled[:, 1], marker='.', s=2, color=colour)
+        else:
+            handles.append(ax.scatter(posses[:, 0], posses[:, 2], posses[:, 1], marker=marker))
 
         ax.set_autoscalex_on(False)
-        ax.set_xlim([-4.5, 1])
-        ax.set_ylim([0, 5.5])
-        ax.set_zlim([-1, 4.5])
+        if density:
+            ax.set_xlim(bounds[0])
+            ax.set_ylim(bounds[1])
+            ax.set_zlim(bounds[2])
+        else:
+            ax.set_xlim([-4.5, 1])
+            ax.set_ylim([0, 5.5])
+            ax.set_zlim([-1, 4.5])
 
         ax.set_xlabel('X (ft)')
         ax.set_ylabel('Z (ft)')
         ax.set_zlabel('Y (ft)')
 
-    plt.legend([layout_name(e) for e in Layouts if e != Layouts.SliderOnly], loc='center left')
-    # plt.title('Stylus Positions in Cave on Keypress by Interface')
-    plt.savefig("../../Results/Figures/pos-cloud.png", transparent=True)
-    plt.show()
+    ax.legend(handles, [layout_name(e) for e, _, _ in shown], loc='center left')
+    # ax.set_title('Stylus Positions in Cave on Keypress by Interface')
+    return [finish_figure(fig, "pos-cloud" + ("-density" if density else "") + ".png", show, directory)]
 
 
-def make_2d_point_cloud(data, axes):
-    fig = plt.figure()
+@profiled()
+def make_2d_point_cloud(data, axes, show=True, directory=figures_dir, density=False, bins=64, overlay=0, seed=0):
+    # density draws each layout as contours of a bins x bins histogram over the shared extent of the
+    # layouts; overlay adds that many sampled points per layout
+    from matplotlib.lines import Line2D
+    fig = new_figure(show)
     ax = fig.add_subplot(111)
 
-    for layout, marker in zip((e.value for e in Layouts), ['o', '^', '.', 's']):
-        posses = data.layout_posses[layout]
-        if not posses or layout == Layouts.SliderOnly.value:
-            continue
-
-        xs = [v[axes[0]] for v in posses]
-        ys = [v[axes[1]] for v in posses]
-
-        ax.scatter(xs, ys, marker=marker)
+    shown = [(e, data.layout_posses[e.value], marker) for e, marker in zip(Layouts, ['o', '^', '.', 's'])
+             if e != Layouts.SliderOnly and len(data.layout_posses[e.value])]
+    if density and shown:
+        bounds = cloud_bounds([posses[:, axes] for _, posses, _ in shown])
+
+    handles = list()
+    for layout, posses, marker in shown:
+        xs = posses[:, axes[0]]
+        ys = posses[:, axes[1]]
+
+        colour = 'C%d' % len(handles)
+        if density:
+            counts, xedges, yedges = np.histogram2d(xs, ys, bins=bins, range=bounds)
+            if counts.max() > counts.min():
+                ax.contour((xedges[:-1] + xedges[1:]) / 2, (yedges[:-1] + yedges[1:]) / 2, counts.T,
+                           levels=4, colors=colour)
+            handles.append(Line2D([], [], color=colour, label=layout_name(layout)))
+            if overlay:
+                sampled = sample_points(posses, overlay, seed)
+                ax.scatter(sampled[:, axes[0]], sampled[:, axes[1]], marker='.', s=2, color=colour)
+        else:
+            handles.append(ax.scatter(xs, ys, marker=marker, color=colour, label=layout_name(layout)))
         # ax.plot(np.mean(xs), np.mean(ys), marker='H')
 
         # ax.set_autoscalex_on(False)
@@ -279,14 +1143,14 @@ def make_2d_point_cloud(data, axes):
         ax.set_xlabel(axes_labels[axes[0]] + ' (feet)')
         ax.set_ylabel(axes_labels[axes[1]] + ' (feet)')
 
-    plt.legend([layout_name(e) for e in Layouts if e != Layouts.SliderOnly], loc='center left')
-    # plt.title('Stylus Positions in Cave on Keypress by Interface')
-    plt.savefig("../../Results/Figures/pos-2d-cloud-" + '-'.join(map(str, axes)) + ".png", transparent=True)
-    # plt.savefig("../../Results/Figures/pos-2d-cloud-" + '-'.join(map(str, axes)) + ".png")
-    plt.show()
+    ax.legend(handles=handles, loc='center left')
+    # ax.set_title('Stylus Positions in Cave on Keypress by Interface')
+    name = "pos-2d-cloud-" + '-'.join(map(str, axes)) + ("-density" if density else "") + ".png"
+    return [finish_figure(fig, name, show, directory)]
 
 
-def make_wpm_bars(data):
+@profiled()
+def make_wpm_bars(data, show=True, directory=figures_dir):
     perfect_wpm = {k: v for k, v in data.layout_perfect_wpm.items() if k != Layouts.SliderOnly.value}
     blind_wpm = {k: v for k, v in data.layout_blind_wpm.items() if k != Layouts.SliderOnly.value}
     perfect_data = perfect_wpm.values()
@@ -298,21 +1162,24 @@ def make_wpm_bars(data):
     ind = np.arange(len(blind_data))  # the x locations for the groups
     width = 0.35  # the width of the bars: can also be len(x) sequence
 
-    p1 = plt.bar(ind + width, perfect_means, width, align='center', yerr=perfect_std)
-    p2 = plt.bar(ind, blind_means, width, align='center', yerr=blind_std)
+    fig = new_figure(show)
+    ax = fig.add_subplot(111)
+    p1 = ax.bar(ind + width, perfect_means, width, align='center', yerr=perfect_std)
+    p2 = ax.bar(ind, blind_means, width, align='center', yerr=blind_std)
 
-    plt.axes().yaxis.grid(True)  # raises an error?
+    ax.yaxis.grid(True)
 
-    plt.ylabel('WPM')
-    # plt.title('Efficiency')
-    plt.xticks(ind + width/2, list(map(layout_name, blind_wpm.keys())))
-    plt.legend((p1[0], p2[0]), ('Perfect', 'Blind'))
+    ax.set_ylabel('WPM')
+    # ax.set_title('Efficiency')
+    ax.set_xticks(ind + width / 2)
+    ax.set_xticklabels(list(map(layout_name, blind_wpm.keys())))
+    ax.legend((p1[0], p2[0]), ('Perfect', 'Blind'))
 
-    plt.savefig('../../Results/Figures/perfect-blind-wpm.png', transparent=True)
-    plt.show()
+    return [finish_figure(fig, 'perfect-blind-wpm.png', show, directory)]
 
 
-def make_pit_bars(data):
+@profiled()
+def make_pit_bars(data, show=True, directory=figures_dir):
     # https://matplotlib.org/3.1.1/gallery/lines_bars_and_markers/bar_stacked.html
     layouts = [Layouts.ArcType.value, Layouts.TiltType.value]
     ideal_means = [np.mean(data.layout_ideal_travel[v]) for v in layouts]
@@ -322,35 +1189,40 @@ def make_pit_bars(data):
     ind = np.arange(2)  # the x locations for the groups
     width = 0.85  # the width of the bars: can also be len(x) sequence
 
-    p1 = plt.bar(ind, ideal_means, width, yerr=ideal_std, align='center')
-    p2 = plt.bar(ind, [a - b for a, b in zip(actual_means, ideal_means)], width, align='center',
-                 bottom=ideal_means, yerr=actual_std)
+    fig = new_figure(show)
+    ax = fig.add_subplot(111)
+    p1 = ax.bar(ind, ideal_means, width, yerr=ideal_std, align='center')
+    p2 = ax.bar(ind, [a - b for a, b in zip(actual_means, ideal_means)], width, align='center',
+                bottom=ideal_means, yerr=actual_std)
 
-    plt.ylabel('Total Angular Displacement (degrees)')
-    # plt.title('Travel by Interface')
-    plt.xticks(ind, (Layouts.ArcType.value, Layouts.TiltType.value))
-    plt.legend((p1[0], p2[0]), ('Ideal', 'Actual'))
+    ax.set_ylabel('Total Angular Displacement (degrees)')
+    # ax.set_title('Travel by Interface')
+    ax.set_xticks(ind)
+    ax.set_xticklabels((Layouts.ArcType.value, Layouts.TiltType.value))
+    ax.legend((p1[0], p2[0]), ('Ideal', 'Actual'))
 
-    plt.savefig('../../Results/Figures/travel-by-interface-error-bars.png', transparent=True)
-    plt.show()
+    paths = [finish_figure(fig, 'travel-by-interface-error-bars.png', show, directory)]
 
     pit_means = [np.mean(data.layout_pit[v]) for v in layouts]
     pit_std = [np.std(data.layout_pit[v]) for v in layouts]
     # ind = np.arange(2)  # the x locations for the groups
     # width = 0.85  # the width of the bars: can also be len(x) sequence
 
-    fig, ax = plt.subplots()
+    fig = new_figure(show)
+    ax = fig.add_subplot(111)
     ax.bar(ind, pit_means, yerr=pit_std, align='center', alpha=0.5, ecolor='black', capsize=10)
     ax.set_ylabel('PIT (%)')
-    plt.xticks(ind, layouts)
+    ax.set_xticks(ind)
+    ax.set_xticklabels(layouts)
     # ax.set_title('PIT by Interface')
     ax.yaxis.grid(True)
 
-    plt.savefig('../../Results/Figures/pit-by-interface-error-bars.png', transparent=True)
-    plt.show()
+    return paths + [finish_figure(fig, 'pit-by-interface-error-bars.png', show, directory)]
 
 
+@profiled()
 def make_duration_lines(data):
+    import matplotlib.pyplot as plt
     fig, ax = plt.subplots()
     items = list()
     for layout, durations in data.layout_durations.items():
@@ -361,50 +1233,43 @@ def make_duration_lines(data):
     fig.show()
 
 
-def make_error_bars(data):
-    means = list()
-    stds = list()
+@profiled()
+def make_error_bars(data, show=True, directory=figures_dir):
+    layouts, means, stds = list(), list(), list()
     for layout, vals in data.layout_error_rates.items():
         if layout == Layouts.SliderOnly.value:
             continue
+        layouts.append(layout)
         means.append(np.mean(vals))
         stds.append(np.std(vals))
 
     ind = np.arange(3)  # the x locations for the groups
     width = 0.5  # the width of the bars: can also be len(x) sequence
 
-    fig, ax = plt.subplots()
+    fig = new_figure(show)
+    ax = fig.add_subplot(111)
     ax.bar(ind, means, yerr=stds, align='center', alpha=0.5, ecolor='black', capsize=10)
 
+    ax.set_ylabel('Error Rates (%)')
+    ax.set_xticks(ind)
+    # labelled from the same dict as the bars: layout_error_rates is in Layouts order, layout_blind_io isn't
+    ax.set_xticklabels([layout_name(layout) for layout in layouts])
+    ax.set_xlabel("Layouts")
 
-    plt.ylabel('Error Rates (%)')
-    plt.xticks(ind, (layout_name(e) for e in data.layout_blind_io.keys() if e != Layouts.SliderOnly.value))
-    plt.xlabel("Layouts")
-
-    plt.savefig('../../Results/Figures/error-chart.png', transparent=True)
-    plt.show()
+    return [finish_figure(fig, 'error-chart.png', show, directory)]
 
 
-def make_relative_error_bars(data):
+@profiled()
+def make_relative_error_bars(data, show=True, directory=figures_dir):
+    # errors are counted on the levenshtein alignment of each prompt and output, so characters after
+    # an insertion or deletion are still compared with the ones they were meant to be
+    breakdown = error_breakdown({layout: pairs for layout, pairs in data.layout_blind_io.items()
+                                 if layout != Layouts.SliderOnly.value})
     items = list()
-    for layout, pairs in data.layout_blind_io.items():
-        if layout == Layouts.SliderOnly.value:
-            continue
-        errors = 0
-        off_by_one = 0
-        dipped = 0
-        for prompt, output in pairs:
-            for p, o in zip(prompt, output):
-                if layout == Layouts.TiltType.value or layout == Layouts.ArcType.value:
-                    a, b = tilttype_displacement(p, o, signed=True)
-                else:
-                    a, b = raycast_displacement(p, o, signed=True)
-                if b == -1:
-                    dipped += 1
-                if abs(a) + abs(b) == 1:
-                    off_by_one += 1
-                if p != o:
-                    errors += 1
+    for layout, counts in breakdown.items():
+        errors = max(counts.sum(), 1)
+        dipped = counts[error_classes.index("dipped")]
+        off_by_one = counts[error_classes.index("off-by-one")]
         items.append((layout, 100 * dipped / errors, 100 * off_by_one / errors))
         # print((layout, dipped, off_by_one, errors))
     off_by_one_pcts = [obo for _, _, obo in items]
@@ -412,56 +1277,237 @@ def make_relative_error_bars(data):
     ind = np.arange(3)  # the x locations for the groups
     width = 0.5  # the width of the bars: can also be len(x) sequence
 
-    p1 = plt.bar(ind, dipped_pcts, width, align='center')[0]
-    p2 = plt.bar(ind, [a - b for a, b in zip(off_by_one_pcts, dipped_pcts)], width, align='center', bottom=dipped_pcts)[
-        0]
-
-    plt.ylabel('Percent of Errors')
-    # plt.title('Travel by Interface')
-    plt.xticks(ind, (layout_name(e) for e in data.layout_blind_io.keys() if e != Layouts.SliderOnly.value))
-    plt.xlabel("Layouts")
-    plt.legend((p1, p2), ('Dipped (y + 1)', 'Off-by-One'))
-
-    plt.savefig('../../Results/Figures/error-type-chart.png', transparent=True)
-    plt.show()
-
+    fig = new_figure(show)
+    ax = fig.add_subplot(111)
+    p1 = ax.bar(ind, dipped_pcts, width, align='center')[0]
+    p2 = ax.bar(ind, off_by_one_pcts, width, align='center', bottom=dipped_pcts)[0]
+
+    ax.set_ylabel('Percent of Errors')
+    # ax.set_title('Travel by Interface')
+    ax.set_xticks(ind)
+    ax.set_xticklabels([layout_name(layout) for layout, _, _ in items])
+    ax.set_xlabel("Layouts")
+    ax.legend((p1, p2), ('Dipped (y + 1)', 'Other Off-by-One'))
+
+    return [finish_figure(fig, 'error-type-chart.png', show, directory)]
+
+
+# every figure render_figures knows how to draw: name -> (function, extra args, the Data fields it reads)
+figure_jobs = {
+    "pos-cloud": (make_point_cloud, (), {}, ("layout_posses",)),
+    "pos-2d-cloud-0-2": (make_2d_point_cloud, ([0, 2],), {}, ("layout_posses",)),
+    "pos-2d-cloud-1-2": (make_2d_point_cloud, ([1, 2],), {}, ("layout_posses",)),
+    "pos-cloud-density": (make_point_cloud, (), {"density": True, "overlay": 500}, ("layout_posses",)),
+    "pos-2d-cloud-0-2-density": (make_2d_point_cloud, ([0, 2],), {"density": True, "overlay": 500},
+                                 ("layout_posses",)),
+    "pos-2d-cloud-1-2-density": (make_2d_point_cloud, ([1, 2],), {"density": True, "overlay": 500},
+                                 ("layout_posses",)),
+    "perfect-blind-wpm": (make_wpm_bars, (), {}, ("layout_perfect_wpm", "layout_blind_wpm")),
+    "pit-bars": (make_pit_bars, (), {}, ("layout_ideal_travel", "layout_actual_travel", "layout_pit")),
+    "error-chart": (make_error_bars, (), {}, ("layout_error_rates",)),
+    "error-type-chart": (make_relative_error_bars, (), {}, ("layout_blind_io",)),
+}
+_render_snapshot = None
+
+
+def _load_render_snapshot(path):
+    global _render_snapshot
+    import matplotlib
+    matplotlib.use("Agg")
+    with open(path, 'rb') as pickled:
+        _render_snapshot = pickle.load(pickled)
+
+
+def _draw(data, name, directory):
+    fn, args, kwargs, _ = figure_jobs[name]
+    return fn(data, *args, show=False, directory=directory, **kwargs)
+
+
+def _render_figure(name, directory):
+    return name, _draw(_render_snapshot, name, directory)
+
+
+@profiled()
+def render_figures(data, names=None, directory=figures_dir, workers=None, force=False):
+    # draws figures headless, one per worker process, from a pickled snapshot of data. A figure whose
+    # inputs hash the same as at its last render, recorded in .render-stamps.json, is skipped unless
+    # force is set. The drawing code is this whole module's source, so an edit to a label or to a
+    # shared helper redraws every figure. Returns the names that were redrawn.
+    names = list(figure_jobs) if names is None else names
+    stamps_path = os.path.join(directory, ".render-stamps.json")
+    try:
+        with open(stamps_path) as stamps_file:
+            stamps = json.load(stamps_file)
+    except (OSError, ValueError):
+        stamps = dict()
+
+    with open(os.path.abspath(__file__), 'rb') as source:
+        code = hashlib.sha1(source.read()).hexdigest()
+    digests = dict()
+    for name in names:
+        fn, args, kwargs, fields = figure_jobs[name]
+        inputs = pickle.dumps([[getattr(data, field) for field in fields], args, sorted(kwargs.items()), code],
+                              protocol=pickle.HIGHEST_PROTOCOL)
+        digests[name] = hashlib.sha1(inputs).hexdigest()
+    stale = [name for name in names if force or stamps.get(name, {}).get("digest") != digests[name]
+             or not all(os.path.exists(os.path.join(directory, f)) for f in stamps[name]["files"])]
+    if not stale:
+        return stale
+
+    os.makedirs(directory, exist_ok=True)
+    workers = os.cpu_count() if workers is None else workers
+    if workers > 1 and len(stale) > 1:
+        snapshot = os.path.join(directory, ".render-snapshot.%d.pickle" % os.getpid())
+        with open(snapshot, 'wb') as pickled:
+            pickle.dump(data, pickled, protocol=pickle.HIGHEST_PROTOCOL)
+        try:
+            with ProcessPoolExecutor(max_workers=min(workers, len(stale)), initializer=_load_render_snapshot,
+                                     initargs=(snapshot,)) as pool:
+                rendered = list(pool.map(_render_figure, stale, repeat(directory)))
+        finally:
+            os.remove(snapshot)
+    else:
+        rendered = [(name, _draw(data, name, directory)) for name in stale]
+
+    for name, files in rendered:
+        stamps[name] = {"digest": digests[name], "files": [os.path.relpath(f, directory) for f in files]}
+    with open(stamps_path, 'w') as stamps_file:
+        json.dump(stamps, stamps_file, indent=2, sort_keys=True)
+    return stale
+
+
+@profiled()
+def layout_partials(challenges, keypresses, skip_practice=True):
+    # the per-layout, per-challenge values get_data summarizes, before any outlier rejection;
+    # partials from separate files can be combined with merge_partials. Travelled challenges keep
+    # their prompts, and ideal travel is only looked up once the partials are merged (layout_travel).
+    rot_travel = table_rot_travel(challenges, keypresses)
+
+    counted = challenges["type"] != 'Practice' if skip_practice else np.ones(len(challenges), dtype=bool)
+    blind = challenges[counted & (challenges["type"] == 'Blind')]
+    perfect = challenges[counted & (challenges["type"] == 'Perfect')]
+    blind_io = list(zip(blind["prompt"], blind["output"]))
+
+    travelled = counted & np.isin(challenges["layout"], [Layouts.ArcType.value, Layouts.TiltType.value])
+
+    return {
+        "layout_blind_wpm": group_by(blind["layout"], table_words_per_minute(blind)),
+        "layout_blind_awpm": group_by(blind["layout"], table_accurate_words_per_minute(blind)),
+        "layout_perfect_wpm": group_by(perfect["layout"], table_words_per_minute(perfect)),
+        "layout_durations": group_by(challenges["layout"][counted], challenges["duration"][counted]),
+        "layout_blind_io": {layout: [blind_io[i] for i in rows]
+                            for layout, rows in group_by(blind["layout"], np.arange(len(blind))).items()},
+        "layout_error_rates": group_by(blind["layout"], batch_error_rates(blind_io)),
+        "layout_travel": group_by(challenges["layout"][travelled], rot_travel[travelled]),
+        "layout_travel_prompts": group_by(challenges["layout"][travelled], challenges["prompt"][travelled]),
+        "layout_posses": {e.value: extract_layout_positions(challenges, keypresses, e.value) for e in Layouts},
+    }
+
+
+@profiled()
+def merge_partials(partials):
+    pieces = defaultdict(lambda: defaultdict(list))
+    for partial in partials:
+        for name, layouts in partial.items():
+            for layout, values in layouts.items():
+                pieces[name][layout].append(values)
+
+    return {name: {layout: np.concatenate(values) if isinstance(values[0], np.ndarray) else sum(values, [])
+                   for layout, values in layouts.items()} for name, layouts in pieces.items()}
+
+
+def file_partials(path, skip_practice=True, stream=False, chunk_size=64):
+    if not stream:
+        return layout_partials(*file_tables(path), skip_practice=skip_practice)
+
+    items = iter_trial(path)
+    chunks = iter(lambda: list(islice(items, chunk_size)), [])
+    return merge_partials(layout_partials(*trial_tables({"trial": chunk}), skip_practice=skip_practice)
+                          for chunk in chunks)
+
+
+# bump whenever layout_partials changes what it returns, so manifests holding the old partials are rebuilt
+partials_version = 3
+
+
+def layout_travel(partials):
+    # {layout: (actual, ideal)} per travelled challenge. Ideal travel is looked up here, in the process
+    # holding the merged partials, so every session's prompts go through the one ideal_travel_cache
+    # whose counters that process reports.
+    prompts = partials.get("layout_travel_prompts", {})
+    return {layout: (actual, ideal_travel_cache.travel(layout, prompts[layout]))
+            for layout, actual in partials.get("layout_travel", {}).items()}
+
+
+@profiled()
+def manifest_partials(paths, directory=results_dir, skip_practice=True, workers=None, stream=False):
+    # the manifest keeps each file's partials next to its mtime, size and sha1, so only new or
+    # changed files are parsed; a touched but unchanged file just has its mtime refreshed. A manifest
+    # written for another partials_version is discarded whole.
+    manifest_path = os.path.join(directory, ".metrics-manifest.pickle")
+    try:
+        with open(manifest_path, 'rb') as pickled:
+            saved = pickle.load(pickled)
+    except (OSError, EOFError, pickle.UnpicklingError):
+        saved = dict()
+    manifest = saved.get("entries", dict()) if saved.get("version") == partials_version else dict()
+
+    entries, stale = dict(), list()
+    for path in paths:
+        key = os.path.relpath(path, directory)
+        stat = os.stat(path)
+        entry = manifest.get(key)
+        if entry is not None and entry["skip_practice"] == skip_practice \
+                and (entry["mtime"], entry["size"]) == (stat.st_mtime_ns, stat.st_size):
+            entries[key] = entry
+            continue
 
-def get_data(skip_practice=True):
-    layout_pit, layout_blind_wpm, layout_blind_awpm, layout_perfect_wpm, layout_blind_io, layout_durations = \
-        (defaultdict(list) for _ in range(6))
+        with open(path, 'rb') as yams:
+            digest = hashlib.sha1(yams.read()).hexdigest()
+        if entry is not None and entry["skip_practice"] == skip_practice and entry["sha1"] == digest:
+            entries[key] = dict(entry, mtime=stat.st_mtime_ns, size=stat.st_size)
+        else:
+            entries[key] = dict(mtime=stat.st_mtime_ns, size=stat.st_size, sha1=digest,
+                                skip_practice=skip_practice, partials=None)
+            stale.append(path)
+
+    for path, partials in zip(stale, map_files(file_partials, stale, workers, skip_practice, stream)):
+        entries[os.path.relpath(path, directory)]["partials"] = partials
+
+    if stale or entries.keys() != manifest.keys():
+        partial = manifest_path + ".%d.tmp" % os.getpid()
+        with open(partial, 'wb') as pickled:
+            pickle.dump({"version": partials_version, "entries": entries}, pickled, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(partial, manifest_path)
+
+    return [entries[os.path.relpath(path, directory)]["partials"] for path in paths]
+
+
+@profiled()
+def get_data(skip_practice=True, directory=results_dir, workers=None, incremental=False, stream=False):
+    # stream=True parses each file a chunk of challenges at a time rather than loading it whole
+    with stage("discover_trials"):
+        paths = discover_trials(directory)
+    if incremental:
+        partials = merge_partials(manifest_partials(paths, directory, skip_practice, workers, stream))
+    elif stream:
+        partials = merge_partials(map_files(file_partials, paths, workers, skip_practice, stream))
+    else:
+        partials = layout_partials(*load_tables(paths, workers=workers), skip_practice=skip_practice)
+    return summarize(partials)
+
+
+@profiled()
+def summarize(partials):
+    layout_blind_wpm, layout_blind_awpm, layout_perfect_wpm, layout_durations, layout_blind_io, error_rates = \
+        (defaultdict(list, partials.get(name, {})) for name in ("layout_blind_wpm", "layout_blind_awpm",
+                                                                "layout_perfect_wpm", "layout_durations",
+                                                                "layout_blind_io", "layout_error_rates"))
+    travel = layout_travel(partials)
+    layout_pit = dict.fromkeys(travel)
+    no_posses = np.zeros((0, 3), dtype=np.float32)
+    layout_posses = {e.value: partials.get("layout_posses", {}).get(e.value, no_posses) for e in Layouts}
     layout_actual_travel, layout_ideal_travel, layout_error_rates = (dict() for _ in range(3))
-    trials = get_all_trials()
-    for trial in trials.values():
-        for challenge in trial["trial"]:
-            if "command" in challenge:
-                continue
-            else:
-                challenge = challenge["challenge"]
-
-            if challenge['type'] == 'Practice' and skip_practice:
-                continue
-
-            if challenge['type'] == 'Blind':
-                layout_blind_wpm[challenge["layout"]].append(words_per_minute(challenge))
-                layout_blind_awpm[challenge["layout"]].append(accurate_words_per_minutes(challenge))
-
-            if challenge['type'] == 'Perfect':
-                layout_perfect_wpm[challenge["layout"]].append(words_per_minute(challenge))
-
-            layout = challenge['layout']
-            if layout == Layouts.ArcType.value:
-                layout_pit[layout].append((challenge_rot_travel(challenge), arctype_ideal(challenge['prompt'])))
-            elif layout == Layouts.TiltType.value:
-                layout_pit[layout].append((challenge_rot_travel(challenge), tilttype_ideal(challenge['prompt']),
-                                           tilttype_ideal_tuple(challenge['prompt'])))
-
-            layout_durations[layout].append(challenge['time']['duration'])
-
-            if challenge['type'] == 'Blind':
-                layout_blind_io[layout].append((challenge['prompt'], challenge['output']))
-
-    merged = merge_trials(*trials.values())
-    layout_posses = {e.value: extract_layout_positions(merged, e.value) for e in Layouts}
     travel_csv = [["Layout", "Avg Travel", "Std Dev Travel", "Avg PIT", "Std Dev PIT"]]
     main_csv = [["Layout", "Avg BlindWPM", "Std Dev BlindWPM", "Avg PerfectWPM", "Std Dev PerfectWPM",
                  "Avg Error", "Std Dev Error"]]
@@ -482,19 +1528,20 @@ def get_data(skip_practice=True):
         dur_data = reject_outliers(np.array(layout_durations[layout]))
         layout_durations[layout] = dur_data
 
-        error_data = [error_rate(*p) for p in layout_blind_io[layout]]
+        error_data = np.asarray(error_rates[layout], dtype=np.float64)
         layout_error_rates[layout] = error_data
         row.append(np.mean(error_data))
         row.append(np.std(error_data))
 
-        if layout in layout_pit:
-            actual_data = reject_outliers(np.array([t[0] for t in layout_pit[layout]]))
+        if layout in travel:
+            actual, ideal = travel[layout]
+            actual_data = reject_outliers(actual)
             layout_actual_travel[layout] = actual_data
 
-            ideal_data = reject_outliers(np.array([t[1] for t in layout_pit[layout]]))
+            ideal_data = reject_outliers(ideal)
             layout_ideal_travel[layout] = ideal_data
 
-            pit_data = reject_outliers(np.array([100 * t[0] / t[1] for t in layout_pit[layout]]))
+            pit_data = reject_outliers(100 * actual / ideal)
             layout_pit[layout] = pit_data
 
             travel_csv.append([layout, np.mean(actual_data), np.std(actual_data), np.mean(pit_data), np.std(pit_data)])
@@ -509,6 +1556,109 @@ def get_data(skip_practice=True):
                 layout_perfect_wpm=layout_perfect_wpm)
 
 
+# the per-layout metrics get_data reports, and whether summarize trims each with reject_outliers
+summary_metrics = {"blind_wpm": True, "perfect_wpm": True, "blind_awpm": True, "durations": True,
+                   "error_rates": False, "actual_travel": True, "ideal_travel": True, "pit": True}
+
+
+def partial_values(partials):
+    # ((layout, metric), values) for everything in one set of layout_partials but travel, whose ideal
+    # half is only known once the partials are merged (see travel_values)
+    for metric in ("blind_wpm", "perfect_wpm", "blind_awpm", "durations", "error_rates"):
+        for layout, values in partials.get("layout_" + metric, {}).items():
+            yield (layout, metric), np.asarray(values, dtype=np.float64)
+
+
+def travel_values(partials):
+    # ((layout, metric), values) of the travel metrics of merged partials
+    for layout, (actual, ideal) in layout_travel(partials).items():
+        yield (layout, "actual_travel"), actual
+        yield (layout, "ideal_travel"), ideal
+        yield (layout, "pit"), 100 * actual / ideal
+
+
+class LayoutStats:
+    # a RunningStats, and with sketch=True a QuantileSketch, per (layout, metric); partial LayoutStats
+    # from separate files or workers combine with merge
+    def __init__(self, sketch=False):
+        self.stats = defaultdict(RunningStats)
+        self.sketches = defaultdict(QuantileSketch) if sketch else None
+
+    def add(self, key, values):
+        self.stats[key].add(values)
+        if self.sketches is not None:
+            self.sketches[key].add(values)
+        return self
+
+    def merge(self, other):
+        for key, stats in other.stats.items():
+            self.stats[key].merge(stats)
+        if self.sketches is not None and other.sketches is not None:
+            for key, sketch in other.sketches.items():
+                self.sketches[key].merge(sketch)
+        return self
+
+
+def file_stats(path, skip_practice=True, stream=False, sketch=False, reference=None, m=2):
+    # reference is the merged LayoutStats of a first pass; values outside its m std bounds are dropped.
+    # The file's travel partials come back as they are, for the caller to merge and look up.
+    partials = file_partials(path, skip_practice, stream)
+    stats = LayoutStats(sketch)
+    for key, values in partial_values(partials):
+        if reference is not None and summary_metrics[key[1]]:
+            values = reference.stats[key].within(values, m)
+        stats.add(key, values)
+    return stats, {name: partials.get(name, {}) for name in ("layout_travel", "layout_travel_prompts")}
+
+
+def get_summary(skip_practice=True, directory=results_dir, workers=None, stream=False, rejection="two-pass", m=2):
+    # the main and travel csv rows of get_data, from per-file RunningStats instead of every value.
+    # rejection="two-pass" reads the files twice and matches reject_outliers; "mad" trims at m scaled
+    # MADs around the median from a QuantileSketch in one pass; None keeps every value. Travel is the
+    # exception: one value per travelled challenge comes back to this process, which looks up ideal
+    # travel through its own ideal_travel_cache, like get_data.
+    paths = discover_trials(directory)
+    first = LayoutStats(sketch=rejection == "mad")
+    travelled = list()
+    for part, travel in map_files(file_stats, paths, workers, skip_practice, stream, rejection == "mad"):
+        first.merge(part)
+        travelled.append(travel)
+    travel = list(travel_values(merge_partials(travelled)))
+    for key, values in travel:
+        first.add(key, values)
+
+    if rejection == "two-pass":
+        second = LayoutStats()
+        for part, _ in map_files(file_stats, paths, workers, skip_practice, stream, False, first, m):
+            second.merge(part)
+        for key, values in travel:
+            second.add(key, first.stats[key].within(values, m))
+        trimmed = second.stats.__getitem__
+    elif rejection == "mad":
+        trimmed = lambda key: first.sketches[key].trimmed(m)
+    elif rejection is None:
+        trimmed = first.stats.__getitem__
+    else:
+        raise ValueError("unknown rejection %r" % rejection)
+
+    def stats(layout, metric):
+        return trimmed((layout, metric)) if summary_metrics[metric] else first.stats[layout, metric]
+
+    travel_csv = [["Layout", "Avg Travel", "Std Dev Travel", "Avg PIT", "Std Dev PIT"]]
+    main_csv = [["Layout", "Avg BlindWPM", "Std Dev BlindWPM", "Avg PerfectWPM", "Std Dev PerfectWPM",
+                 "Avg Error", "Std Dev Error"]]
+    for layout in (e.value for e in Layouts):
+        row = [layout]
+        for metric in ("blind_wpm", "perfect_wpm", "error_rates"):
+            row += [stats(layout, metric).mean, stats(layout, metric).std]
+        main_csv.append(row)
+
+        if (layout, "actual_travel") in first.stats:
+            actual, pit = stats(layout, "actual_travel"), stats(layout, "pit")
+            travel_csv.append([layout, actual.mean, actual.std, pit.mean, pit.std])
+    return main_csv, travel_csv
+
+
 class Data:
     def __init__(self, **kwargs):
         self.main_csv = kwargs['main_csv']
@@ -525,34 +1675,23 @@ class Data:
         self.layout_error_rates = kwargs['layout_error_rates']
 
 
-def write_csv(name, rows, digits=2):
-    with open('../../Results/' + name + '.csv', 'w', newline='') as csvfile:
+@profiled()
+def write_csv(name, rows, digits=2, directory=results_dir):
+    with open(os.path.join(directory, name + '.csv'), 'w', newline='') as csvfile:
         rows = [[(truncate(x, digits=digits) if isinstance(x, float) else x) for x in row] for row in rows]
         csv.writer(csvfile).writerows(rows)
 
 
-if __name__ == '__main__':
-    data = get_data()
-    # make_point_cloud(data)
-    # make_2d_point_cloud(data, [0, 2])
-    # make_2d_point_cloud(data, [1, 2])
-
-    # make_wpm_bars(data)
-    # make_pit_bars(data)
-    # make_duration_lines(data)  # broken
-
-    make_error_bars(data)
-    make_relative_error_bars(data)
-
-    write_csv('main', data.main_csv, digits=2)
-    write_csv('travels', data.travel_csv, digits=2)
-
-    merged = merge_trials(*[get_trial(n) for n in range(3)])['trial']
+def print_prompt_stats(directory=results_dir):
+    # over every trial found under directory, streamed one item at a time
     prompts = list()
-    for challenge in merged:
-        if 'command' in challenge:
-            continue
-        prompts.append(challenge['challenge']['prompt'])
+    for path in discover_trials(directory):
+        for item in iter_trial(path):
+            if 'challenge' in item:
+                prompts.append(item['challenge']['prompt'])
+    if not prompts:
+        print('no prompts under', directory)
+        return
 
     chars_per_prompt = list(map(len, prompts))
 
@@ -562,11 +1701,58 @@ if __name__ == '__main__':
 
     print('words per prompt', np.mean(words_per_prompt), np.std(words_per_prompt))
 
-    chars = [defaultdict(int) for _ in range(6)]
-    for prompt in prompts:
-        for word in prompt.split():
-            for i in range(min(len(word), len(chars))):
-                chars[i][word[i]] += 1
 
-    for k, vs in data.layout_error_rates.items():
-        print(k, np.mean(vs))
+stages = ("csv", "figures", "stats", "prompts")
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Summarize trial files into csvs, figures and statistics.")
+    parser.add_argument("--input", default=results_dir, help="directory searched for trial-*.yaml")
+    parser.add_argument("--output", help="directory for csvs (figures go in its Figures/); default --input")
+    parser.add_argument("--stages", nargs="+", choices=stages, default=["csv", "figures"])
+    parser.add_argument("--figures", nargs="+", choices=list(figure_jobs), help="only draw these figures")
+    parser.add_argument("--force", action="store_true", help="redraw figures even when their inputs are unchanged")
+    parser.add_argument("--workers", type=int, default=None, help="processes to use (default: every core)")
+    parser.add_argument("--include-practice", action="store_true")
+    parser.add_argument("--boot", type=int, default=10000, help="resamples for the stats stage")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--profile", metavar="PATH",
+                        help="time every stage and write the report to PATH: json if it ends in .json, "
+                             "otherwise collapsed stacks for a flamegraph")
+    parser.add_argument("--profile-memory", action="store_true", help="also track peak memory (slower)")
+    args = parser.parse_args(argv)
+    output = args.output or args.input
+    if args.profile:
+        profiler.enable(memory=args.profile_memory)
+
+    data = get_data(skip_practice=not args.include_practice, directory=args.input, workers=args.workers,
+                    incremental=True)
+    os.makedirs(output, exist_ok=True)
+
+    if "csv" in args.stages:
+        write_csv('main', data.main_csv, digits=2, directory=output)
+        write_csv('travels', data.travel_csv, digits=2, directory=output)
+
+    if "figures" in args.stages:
+        render_figures(data, args.figures, os.path.join(output, "Figures"), args.workers, args.force)
+
+    if "stats" in args.stages:
+        from inference import layout_inference
+        ci_rows, test_rows = layout_inference(data, args.boot, args.boot, seed=args.seed, workers=args.workers)
+        write_csv('intervals', ci_rows, digits=4, directory=output)
+        write_csv('permutation-tests', test_rows, digits=5, directory=output)
+        for k, vs in data.layout_error_rates.items():
+            print(k, np.mean(vs))
+
+    if "prompts" in args.stages:
+        print_prompt_stats(args.input)
+
+    if args.profile:
+        profiler.write(args.profile)
+        profiler.print_summary()
+
+
+if __name__ == '__main__':
+    main()
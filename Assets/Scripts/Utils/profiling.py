@@ -0,0 +1,103 @@
+import json
+import time
+import tracemalloc
+from contextlib import contextmanager
+from functools import wraps
+
+
+class Profiler:
+    # wall and cpu time, call counts and peak traced memory per stage, where a stage's path is the
+    # stages open around it. Only this process is seen: stages run in worker processes are counted
+    # as part of the stage that waits on them. Disabled, a stage costs one flag check.
+    def __init__(self):
+        self.enabled = False
+        self.memory = False
+        self.stats = dict()
+        self.open = list()
+
+    def enable(self, memory=True):
+        self.enabled, self.memory = True, memory
+        if memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def disable(self):
+        if self.memory and tracemalloc.is_tracing():
+            tracemalloc.stop()
+        self.enabled = self.memory = False
+
+    def reset(self):
+        self.stats.clear()
+
+    @contextmanager
+    def stage(self, name):
+        if not self.enabled:
+            yield
+            return
+
+        # tracemalloc has one peak for the whole process, so each open stage remembers the highest
+        # peak of the stages that closed inside it before the peak was reset for the next one
+        if self.memory:
+            if self.open:
+                self.open[-1]["peak"] = max(self.open[-1]["peak"], tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+        frame = {"path": tuple(f["name"] for f in self.open) + (name,), "name": name, "peak": 0,
+                 "base": tracemalloc.get_traced_memory()[0] if self.memory else 0}
+        self.open.append(frame)
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+            self.open.pop()
+            peak = 0
+            if self.memory:
+                peak = max(frame["peak"], tracemalloc.get_traced_memory()[1])
+                if self.open:
+                    self.open[-1]["peak"] = max(self.open[-1]["peak"], peak)
+            stats = self.stats.setdefault(frame["path"], {"calls": 0, "wall": 0.0, "cpu": 0.0, "peak": 0})
+            stats["calls"] += 1
+            stats["wall"] += wall
+            stats["cpu"] += cpu
+            stats["peak"] = max(stats["peak"], peak - frame["base"])
+
+    def profiled(self, name=None):
+        # decorator running every call of a function as a stage named after it
+        def decorate(fn):
+            @wraps(fn)
+            def timed(*args, **kwargs):
+                if not self.enabled:
+                    return fn(*args, **kwargs)
+                with self.stage(name or fn.__name__):
+                    return fn(*args, **kwargs)
+
+            return timed
+
+        return decorate
+
+    def report(self):
+        # one entry per stage path, outermost first; self_wall leaves out the time of nested stages
+        children = dict()
+        for path, stats in self.stats.items():
+            children[path[:-1]] = children.get(path[:-1], 0.0) + stats["wall"]
+        return [dict(stage=";".join(path), self_wall=stats["wall"] - children.get(path, 0.0), **stats)
+                for path, stats in sorted(self.stats.items())]
+
+    def write(self, path):
+        # a .json path gets the report; anything else gets collapsed stacks of self time in
+        # microseconds, the input of flamegraph.pl and speedscope
+        report = self.report()
+        with open(path, 'w') as out:
+            if path.endswith(".json"):
+                json.dump(report, out, indent=2)
+            else:
+                out.writelines("%s %d\n" % (r["stage"], round(1e6 * max(r["self_wall"], 0))) for r in report)
+
+    def print_summary(self, out=None):
+        for r in self.report():
+            print("%-60s %6d calls %9.4f s wall %9.4f s cpu %10.1f KiB peak" % (
+                r["stage"], r["calls"], r["wall"], r["cpu"], r["peak"] / 1024), file=out)
+
+
+profiler = Profiler()
+stage = profiler.stage
+profiled = profiler.profiled
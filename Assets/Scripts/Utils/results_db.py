@@ -0,0 +1,155 @@
+import argparse
+import os
+import sqlite3
+
+import numpy as np
+
+import metrics
+from metrics import Layouts
+
+default_db = os.path.join(metrics.results_dir, "results.sqlite")
+
+# challenges carry their metrics precomputed at export, so a query is one indexed SELECT; ideal
+# travel and pit are only known for the layouts with an ideal path (ArcType, TiltType)
+schema = '''
+CREATE TABLE sessions (id INTEGER PRIMARY KEY, path TEXT NOT NULL);
+CREATE TABLE challenges (
+    id INTEGER PRIMARY KEY, session INTEGER NOT NULL REFERENCES sessions(id), layout TEXT NOT NULL,
+    type TEXT NOT NULL, prompt TEXT NOT NULL, output TEXT NOT NULL, start REAL, stop REAL, duration REAL,
+    wpm REAL, awpm REAL, error_rate REAL, rot_travel REAL, ideal_travel REAL, pit REAL);
+CREATE TABLE keypresses (
+    challenge INTEGER NOT NULL REFERENCES challenges(id), time REAL NOT NULL, key TEXT NOT NULL,
+    pos_x REAL, pos_y REAL, pos_z REAL, rot_x REAL, rot_y REAL, rot_z REAL,
+    press_x REAL, press_y REAL, press_z REAL);
+CREATE INDEX challenges_layout_type ON challenges (layout, type);
+CREATE INDEX challenges_session ON challenges (session);
+CREATE INDEX challenges_prompt ON challenges (prompt);
+CREATE INDEX keypresses_challenge ON keypresses (challenge, time);
+'''
+challenge_metrics = ("wpm", "awpm", "error_rate", "rot_travel", "ideal_travel", "pit", "duration")
+
+
+def nullable(values):
+    # sqlite stores nan as NULL only if it is handed None
+    return [None if v != v else v for v in values.tolist()]
+
+
+def challenge_columns(challenges, keypresses):
+    # the per-challenge metrics of layout_partials, for every challenge rather than per layout
+    timed = challenges["duration"] > 0
+    wpm, awpm = np.full(len(challenges), np.nan), np.full(len(challenges), np.nan)
+    wpm[timed] = metrics.table_words_per_minute(challenges[timed])
+    awpm[timed] = metrics.table_accurate_words_per_minute(challenges[timed])
+    error_rate = metrics.batch_error_rates(zip(challenges["prompt"], challenges["output"]))
+    rot_travel = metrics.table_rot_travel(challenges, keypresses)
+
+    ideal = np.full(len(challenges), np.nan)
+    for layout in (Layouts.ArcType.value, Layouts.TiltType.value):
+        rows = challenges["layout"] == layout
+        ideal[rows] = metrics.ideal_travel_cache.travel(layout, challenges["prompt"][rows])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        pit = 100 * rot_travel / ideal
+    return wpm, awpm, error_rate, rot_travel, ideal, pit
+
+
+def export(db_path=default_db, directory=metrics.results_dir, workers=None):
+    # rebuilds the database from every trial under directory (parsed through the trial cache)
+    paths = metrics.discover_trials(directory)
+    challenges, keypresses = metrics.load_tables(paths, workers)
+    columns = challenge_columns(challenges, keypresses)
+
+    partial = db_path + ".%d.tmp" % os.getpid()
+    if os.path.exists(partial):
+        os.remove(partial)
+    with sqlite3.connect(partial) as db:
+        db.executescript(schema)
+        db.executemany("INSERT INTO sessions VALUES (?, ?)",
+                       ((i, os.path.relpath(path, directory)) for i, path in enumerate(paths)))
+        db.executemany("INSERT INTO challenges VALUES (%s)" % ", ".join("?" * 15), zip(
+            range(len(challenges)), challenges["session"].tolist(), challenges["layout"].tolist(),
+            challenges["type"].tolist(), challenges["prompt"].tolist(), challenges["output"].tolist(),
+            nullable(challenges["start"]), nullable(challenges["stop"]), nullable(challenges["duration"]),
+            *(nullable(c) for c in columns)))
+        vectors = [nullable(keypresses[field][:, axis]) for field in ("pos", "rot", "press_pos") for axis in range(3)]
+        db.executemany("INSERT INTO keypresses VALUES (%s)" % ", ".join("?" * 12), zip(
+            keypresses["challenge"].tolist(), keypresses["time"].tolist(), keypresses["key"].tolist(), *vectors))
+    db.close()
+    os.replace(partial, db_path)
+    return db_path
+
+
+class ResultsDB:
+    # filters shared by every query: layout and type match exactly, session is the index of the trial
+    # file in discover_trials order, prompt matches exactly and contains is a substring of the prompt
+    def __init__(self, db_path=default_db):
+        self.db = sqlite3.connect(db_path)
+
+    def close(self):
+        self.db.close()
+
+    @staticmethod
+    def where(layout=None, type=None, session=None, prompt=None, contains=None):
+        clauses, params = list(), list()
+        for column, value in (("layout", layout), ("type", type), ("session", session), ("prompt", prompt)):
+            if value is not None:
+                clauses.append("c.%s = ?" % column)
+                params.append(value.value if isinstance(value, Layouts) else value)
+        if contains is not None:
+            clauses.append("instr(c.prompt, ?) > 0")
+            params.append(contains)
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+    def values(self, metric, **filters):
+        # one value of metric per matching challenge (nan where it isn't defined)
+        if metric not in challenge_metrics:
+            raise ValueError("unknown metric %r" % metric)
+        where, params = self.where(**filters)
+        rows = self.db.execute("SELECT c.%s FROM challenges c%s ORDER BY c.id" % (metric, where), params)
+        return np.array([np.nan if v is None else v for v, in rows], dtype=np.float64)
+
+    def mean(self, metric, **filters):
+        # mean and count over the matching challenges, computed by sqlite
+        if metric not in challenge_metrics:
+            raise ValueError("unknown metric %r" % metric)
+        where, params = self.where(**filters)
+        return self.db.execute("SELECT avg(c.%s), count(c.%s) FROM challenges c%s" % (metric, metric, where),
+                               params).fetchone()
+
+    def by_layout(self, metric, **filters):
+        # {layout: values} in Layouts order, like the layout_* attributes of metrics.Data
+        return {e.value: self.values(metric, **dict(filters, layout=e.value)) for e in Layouts}
+
+    def positions(self, **filters):
+        # pressPos of every keypress in the matching challenges, as an (n, 3) float32 array
+        where, params = self.where(**filters)
+        rows = self.db.execute("SELECT k.press_x, k.press_y, k.press_z FROM keypresses k "
+                               "JOIN challenges c ON c.id = k.challenge%s%s ORDER BY k.challenge, k.time"
+                               % (where, (" AND" if where else " WHERE") + " k.press_x IS NOT NULL"), params)
+        return np.array(rows.fetchall(), dtype=np.float32).reshape(-1, 3)
+
+    def challenges(self, **filters):
+        where, params = self.where(**filters)
+        cursor = self.db.execute("SELECT c.* FROM challenges c%s ORDER BY c.id" % where, params)
+        names = [d[0] for d in cursor.description]
+        return [dict(zip(names, row)) for row in cursor]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Export trials to sqlite, or query an export.")
+    parser.add_argument("--db", default=default_db)
+    parser.add_argument("--export", action="store_true", help="rebuild the database from the trial files first")
+    parser.add_argument("--input", default=metrics.results_dir, help="directory searched for trial-*.yaml")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--metric", choices=challenge_metrics, default="error_rate")
+    parser.add_argument("--layout", choices=[e.value for e in Layouts])
+    parser.add_argument("--type", choices=["Practice", "Blind", "Perfect"])
+    parser.add_argument("--session", type=int)
+    parser.add_argument("--contains", help="only prompts containing this text")
+    args = parser.parse_args()
+
+    if args.export or not os.path.exists(args.db):
+        export(args.db, args.input, args.workers)
+    results = ResultsDB(args.db)
+    mean, count = results.mean(args.metric, layout=args.layout, type=args.type, session=args.session,
+                               contains=args.contains)
+    print(args.metric, mean, "over", count, "challenges")
@@ -0,0 +1,217 @@
+import argparse
+import glob
+import hashlib
+import os
+from itertools import islice
+
+import numpy as np
+
+import metrics
+from metrics import Layouts
+
+recordings_dir = os.path.normpath(os.path.join(metrics.results_dir, "..", "RecordedData"))
+recording_cache_name = ".recording-cache"
+default_rate = 90.0
+# recording units -> ideal travel units; the slider records its normalized position, which spans
+# every key of the SliderOnly layout
+recording_scales = {Layouts.SliderOnly.value: sum(metrics.slider_only_widths)}
+trajectory_dtype = np.dtype([("path", np.float64), ("duration", np.float64), ("mean_speed", np.float64),
+                             ("peak_speed", np.float64), ("rms_jerk", np.float64), ("dwell", np.float64)])
+
+
+def discover_recordings(directory=recordings_dir):
+    return sorted(glob.glob(os.path.join(directory, "**", "stylus-output-*.yaml"), recursive=True))
+
+
+def sample_arrays(samples):
+    # (times, values) arrays of the (time, values) samples metrics.iter_recording yields
+    samples = list(samples)
+    return np.array([t for t, _ in samples], dtype=np.float64), \
+        np.array([v for _, v in samples], dtype=np.float32).reshape(len(samples), -1)
+
+
+def load_recording(path, use_cache=True, chunk_samples=1 << 16):
+    # times (float64, as the trials' clocks need) and values (float32, one column per axis) of a
+    # recording, cached as .npy files in a .recording-cache directory next to it, keyed by its sha1,
+    # and handed back memory-mapped. The text is read once, chunk_samples at a time, into raw files
+    # that are then copied block by block behind .npy headers, so it never has to fit in memory.
+    if not use_cache:
+        return sample_arrays(metrics.iter_recording(path))
+
+    digest = hashlib.sha1()
+    with open(path, 'rb') as recording:
+        for block in iter(lambda: recording.read(1 << 20), b""):
+            digest.update(block)
+    cache_dir = os.path.join(os.path.dirname(path), recording_cache_name)
+    stem = os.path.join(cache_dir, digest.hexdigest())
+    try:
+        return np.load(stem + ".times.npy", mmap_mode='r'), np.load(stem + ".values.npy", mmap_mode='r')
+    except (OSError, ValueError):
+        pass
+
+    os.makedirs(cache_dir, exist_ok=True)
+    partial = ".%d.tmp" % os.getpid()
+    samples, width = 0, 1
+    stream = metrics.iter_recording(path)
+    with open(stem + ".times" + partial, 'wb') as raw_times, open(stem + ".values" + partial, 'wb') as raw_values:
+        for chunk in iter(lambda: list(islice(stream, chunk_samples)), []):
+            chunk_times, chunk_values = sample_arrays(chunk)
+            width = chunk_values.shape[1] if not samples else width
+            chunk_times.tofile(raw_times)
+            chunk_values.tofile(raw_values)
+            samples += len(chunk)
+
+    for name, dtype, shape in ((".times", np.float64, (samples,)), (".values", np.float32, (samples, width))):
+        # np.memmap refuses an empty file
+        raw = np.memmap(stem + name + partial, dtype=dtype, mode='r', shape=shape) if samples \
+            else np.zeros(shape, dtype)
+        out = np.lib.format.open_memmap(stem + name + partial + ".npy", mode='w+', dtype=dtype, shape=shape)
+        for first in range(0, samples, chunk_samples):
+            out[first:first + chunk_samples] = raw[first:first + chunk_samples]
+        out.flush()
+        del raw, out
+        os.remove(stem + name + partial)
+        os.replace(stem + name + partial + ".npy", stem + name + ".npy")
+    return np.load(stem + ".times.npy", mmap_mode='r'), np.load(stem + ".values.npy", mmap_mode='r')
+
+
+def sample_at(times, values, at, hold=True):
+    # values at the times in at. The stylus only writes a sample when the value changes, so by default
+    # each holds until the next one; hold=False interpolates linearly instead.
+    if hold:
+        return values[np.clip(np.searchsorted(times, at, side='right') - 1, 0, len(times) - 1)]
+    return np.column_stack([np.interp(at, times, values[:, axis]) for axis in range(values.shape[1])]) \
+        .astype(np.float32)
+
+
+def resample(times, values, rate=default_rate, start=None, stop=None, hold=True):
+    # the recording on a fixed grid of rate samples per second from start to stop
+    start = times[0] if start is None else start
+    stop = times[-1] if stop is None else stop
+    grid = start + np.arange(int(np.floor((stop - start) * rate)) + 1) / rate
+    return grid, sample_at(times, values, grid, hold)
+
+
+def steps(values, angular=False):
+    # per-sample change; angular values (degrees) take the short way round
+    delta = np.diff(values.astype(np.float64), axis=0)
+    if angular:
+        delta = (delta + 180) % 360 - 180
+    return delta
+
+
+def norms(delta):
+    return np.sqrt(np.einsum('ij,ij->i', delta, delta))
+
+
+def cumulative_path(times, values, angular=False, chunk=1 << 20):
+    # running path length at every sample, walked chunk by chunk over (memory-mapped) views
+    out = np.empty(len(times))
+    if not len(times):
+        return out
+    out[0] = total = 0.0
+    for first in range(0, len(times) - 1, chunk):
+        window = values[first:first + chunk + 1]
+        lengths = np.cumsum(norms(steps(window, angular))) + total
+        out[first + 1:first + len(window)] = lengths
+        total = lengths[-1]
+    return out
+
+
+def window_bounds(times, starts, stops):
+    return np.searchsorted(times, starts, side='left'), np.searchsorted(times, stops, side='right')
+
+
+def path_lengths(times, values, starts, stops, angular=False):
+    # path travelled inside each [start, stop] window, counting the step into the window's first sample
+    # from the held value before it
+    cumulative = cumulative_path(times, values, angular)
+    first, last = window_bounds(times, starts, stops)
+    first, last = np.clip(first - 1, 0, None), np.clip(last - 1, 0, None)
+    return np.where(last > first, cumulative[last] - cumulative[np.minimum(first, last)], 0.0)
+
+
+def kinematics(grid_values, rate, angular=False):
+    # speed (|velocity|) and |jerk| of a fixed-rate trajectory, by finite differences
+    velocity = steps(grid_values, angular) * rate
+    jerk = np.diff(velocity, n=2, axis=0) * rate * rate
+    return norms(velocity), norms(jerk)
+
+
+def challenge_trajectories(times, values, starts, stops, rate=default_rate, angular=False, dwell_speed=0.05,
+                           chunk=1 << 18):
+    # per window: path length, duration, mean and peak speed, rms jerk and time spent slower than
+    # dwell_speed (units per second), all from one fixed-rate grid over the whole recording. The grid
+    # is walked chunk by chunk into running sums, and each window reads its totals off them, so the
+    # work is one pass however many windows there are.
+    out = np.zeros(len(starts), dtype=trajectory_dtype)
+    out["duration"] = np.asarray(stops) - np.asarray(starts)
+    out["path"] = path_lengths(times, values, starts, stops, angular)
+    if len(times) < 2 or not len(starts):
+        return out
+
+    origin = min(times[0], np.min(starts))
+    size = int(np.floor((max(times[-1], np.max(stops)) - origin) * rate)) + 1
+    speed_sum, still_sum, jerk_sum = (np.zeros(size + 1) for _ in range(3))
+    speed = np.zeros(size + 1)
+    carry = np.zeros(3)
+    for first in range(0, size, chunk):
+        # three grid points before the chunk (held at the first sample before the grid starts) give
+        # its first points their velocity and jerk
+        end = min(first + chunk, size)
+        grid = origin + np.maximum(np.arange(first - 3, end), 0) / rate
+        chunk_speed, jerk = kinematics(sample_at(times, values, grid), rate, angular)
+        speed[first:end] = chunk_speed[2:]
+        sums = np.cumsum(np.column_stack((speed[first:end], speed[first:end] < dwell_speed, jerk * jerk)), axis=0)
+        sums += carry
+        speed_sum[first + 1:end + 1], still_sum[first + 1:end + 1], jerk_sum[first + 1:end + 1] = sums.T
+        carry = sums[-1]
+
+    first = np.clip(np.ceil((np.asarray(starts) - origin) * rate).astype(np.int64), 0, size)
+    last = np.clip(np.floor((np.asarray(stops) - origin) * rate).astype(np.int64) + 1, first, size)
+    points = last - first
+    with np.errstate(invalid='ignore', divide='ignore'):
+        out["mean_speed"] = (speed_sum[last] - speed_sum[first]) / points
+        out["rms_jerk"] = np.sqrt((jerk_sum[last] - jerk_sum[first]) / points)
+    out["dwell"] = (still_sum[last] - still_sum[first]) / rate
+    peaks = np.maximum.reduceat(speed, np.column_stack((first, last)).ravel())[::2]
+    out["peak_speed"] = np.where(points > 0, peaks, 0)
+    return out
+
+
+def path_pit(layout, prompts, paths, scale=None):
+    # PIT from recorded paths: 100 * path (in ideal travel units) / ideal travel of each prompt
+    scale = recording_scales.get(layout, 1) if scale is None else scale
+    ideal = metrics.ideal_travel_cache.travel(layout, np.asarray(prompts, dtype=object))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return 100 * scale * np.asarray(paths) / ideal
+
+
+def trial_trajectories(recording, trial, rate=default_rate, angular=False, dwell_speed=0.05):
+    # a trial's challenges with the trajectory of each, from a recording taken in the same session
+    challenges, _ = metrics.file_tables(trial)
+    times, values = load_recording(recording)
+    return challenges, challenge_trajectories(times, values, challenges["start"], challenges["stop"], rate,
+                                              angular, dwell_speed)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Trajectories of recorded stylus streams.")
+    parser.add_argument("recordings", nargs="*", help="stylus-output-*.yaml files (default: all in RecordedData)")
+    parser.add_argument("--trial", help="trial file of the same session: report per challenge")
+    parser.add_argument("--rate", type=float, default=default_rate)
+    parser.add_argument("--angular", action="store_true", help="values are angles in degrees")
+    parser.add_argument("--dwell-speed", type=float, default=0.05)
+    args = parser.parse_args()
+
+    for path in args.recordings or discover_recordings():
+        times, values = load_recording(path)
+        if args.trial:
+            challenges, found = trial_trajectories(path, args.trial, args.rate, args.angular, args.dwell_speed)
+            for challenge, row in zip(challenges, found):
+                print(challenge["layout"], challenge["type"], *("%s=%.4g" % (f, row[f]) for f in row.dtype.names))
+            continue
+        whole = challenge_trajectories(times, values, times[:1], times[-1:], args.rate, args.angular,
+                                       args.dwell_speed)[0]
+        print(os.path.basename(path), len(times), "samples",
+              *("%s=%.4g" % (f, whole[f]) for f in trajectory_dtype.names))
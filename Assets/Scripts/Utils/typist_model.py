@@ -0,0 +1,140 @@
+import argparse
+import os
+from string import ascii_uppercase
+
+import numpy as np
+
+import metrics
+from metrics import Layouts
+
+dictionary_path = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "Resources",
+                                                "frequency_dictionary_en_82_765.txt"))
+fitts_dtype = np.dtype([("layout", "U16"), ("a", np.float64), ("b", np.float64), ("r2", np.float64),
+                        ("n", np.int64)])
+
+
+def key_geometry(layout, ordering=ascii_uppercase):
+    # character code -> (x, z, width) in degrees of travel, nan where the layout has no key. A
+    # candidate ordering puts its i-th letter on the key the stock layout gives the i-th letter of
+    # the alphabet; the other keys (space, backspace, punctuation) stay where they are.
+    ordering = ordering.upper()
+    if sorted(ordering) != list(ascii_uppercase):
+        raise ValueError("ordering must hold every letter once: %r" % ordering)
+    scale = metrics.travel_scales[layout]
+    stock = np.column_stack((metrics.layout_tables[layout] * scale, np.full(256, np.min(scale[scale > 0]))))
+    if layout == Layouts.SliderOnly.value:
+        # slider keys differ in width; every other layout's keys are one cell of its grid
+        for key, width in zip(metrics.slider_only_keys, metrics.slider_only_widths):
+            stock[[ord(key), ord(key.lower())], 2] = width
+    stock[np.isnan(stock[:, 0]), 2] = np.nan
+
+    geometry = stock.copy()
+    for letter, place in zip(ordering, ascii_uppercase):
+        geometry[[ord(letter), ord(letter.lower())]] = stock[ord(place)]
+    return geometry
+
+
+def index_of_difficulty(geometry, first, second):
+    # Shannon formulation, log2(D / W + 1), for the move from each first key to each second key
+    step = geometry[second, :2] - geometry[first, :2]
+    distance = np.sqrt(np.einsum('ij,ij->i', step, step))
+    return np.log2(distance / geometry[second, 2] + 1), distance
+
+
+def fit_fitts(challenges, keypresses, skip_practice=True, pause_factor=3):
+    # per layout, least squares of movement time = a + b * ID over every inter-key interval of the
+    # trials, leaving out pauses (see detect_pauses) and keys the layout has no geometry for
+    counted = challenges["type"] != 'Practice' if skip_practice else np.ones(len(challenges), dtype=bool)
+    intervals = metrics.inter_key_intervals(keypresses[counted[keypresses["challenge"]]])
+    paused, _, _ = metrics.detect_pauses(intervals, len(challenges), factor=pause_factor)
+    intervals = intervals[~paused]
+    intervals = intervals[(np.char.str_len(intervals["first"]) == 1) & (np.char.str_len(intervals["second"]) == 1)]
+    layouts = challenges["layout"][intervals["challenge"]]
+
+    models = list()
+    for layout in Layouts:
+        rows = intervals[layouts == layout.value]
+        codes = [metrics.prompt_codes(rows[side].tolist())[0] for side in ("first", "second")]
+        difficulty, _ = index_of_difficulty(key_geometry(layout.value), *codes)
+        known = np.isfinite(difficulty)
+        if np.count_nonzero(known) < 2 or np.ptp(difficulty[known]) == 0:
+            models.append((layout.value, np.nan, np.nan, np.nan, np.count_nonzero(known)))
+            continue
+        x, y = difficulty[known], rows["interval"][known]
+        b, a = np.polyfit(x, y, 1)
+        residual = y - (a + b * x)
+        models.append((layout.value, a, b, 1 - residual.var() / y.var() if y.var() else np.nan, len(x)))
+    return np.array(models, dtype=fitts_dtype)
+
+
+def load_corpus(path=dictionary_path, limit=None):
+    # words (upper case) and their counts from "word count" lines; the file starts with a BOM
+    words, counts = list(), list()
+    with open(path, encoding='utf-8-sig') as dictionary:
+        for line in dictionary:
+            parts = line.split()
+            if len(parts) == 2:
+                words.append(parts[0].upper())
+                counts.append(float(parts[1]))
+            if limit is not None and len(words) >= limit:
+                break
+    return words, np.array(counts)
+
+
+def corpus_transitions(words):
+    # every key-to-key move of typing each word followed by a space, after the space that ended the
+    # word before it: the codes of both keys and the word each move belongs to. Computed once, then
+    # shared by every layout and ordering.
+    codes, lengths = metrics.prompt_codes([" " + w + " " for w in words])
+    owner = np.repeat(np.arange(len(words)), lengths)
+    within = owner[1:] == owner[:-1]
+    return codes[:-1][within], codes[1:][within], owner[1:][within]
+
+
+def predict(model, geometry, transitions, counts):
+    # frequency-weighted WPM and travel per character of the corpus under a fitted model, in one pass
+    # over all its moves; words with a character the layout has no key for are left out
+    first, second, owner = transitions
+    difficulty, distance = index_of_difficulty(geometry, first, second)
+    time = np.bincount(owner, weights=model["a"] + model["b"] * difficulty, minlength=len(counts))
+    travel = np.bincount(owner, weights=distance, minlength=len(counts))
+    chars = np.bincount(owner, minlength=len(counts))
+    typable = ~np.bincount(owner, weights=np.isnan(difficulty), minlength=len(counts)).astype(bool)
+    weights = counts * typable
+    with np.errstate(invalid='ignore', divide='ignore'):
+        wpm = (weights @ chars / 5) / (np.nansum(weights * time) / 60)
+        travel_per_char = np.nansum(weights * travel) / (weights @ chars)
+    return wpm, travel_per_char, weights.sum() / counts.sum()
+
+
+def rank_orderings(models, orderings, words, counts):
+    # predicted WPM, travel per character and corpus coverage of every layout under each candidate
+    # ordering, fastest first within each layout
+    transitions = corpus_transitions(words)
+    rows = list()
+    for model in models:
+        if not np.isfinite(model["b"]):
+            continue
+        found = [(ordering, *predict(model, key_geometry(model["layout"], ordering), transitions, counts))
+                 for ordering in orderings]
+        rows += [[model["layout"], *row] for row in sorted(found, key=lambda row: -row[1])]
+    return [["Layout", "Ordering", "Predicted WPM", "Travel/Char", "Coverage"]] + rows
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Fitts'-law typist model: predicted WPM per layout ordering.")
+    parser.add_argument("orderings", nargs="*", help="candidate letter orderings (the alphabet is always included)")
+    parser.add_argument("--layout", choices=[e.value for e in Layouts], help="only this layout")
+    parser.add_argument("--dictionary", default=dictionary_path)
+    parser.add_argument("--limit", type=int, default=None, help="only the most frequent LIMIT words")
+    parser.add_argument("--include-practice", action="store_true")
+    args = parser.parse_args()
+
+    challenges, keypresses = metrics.load_tables(metrics.discover_trials(metrics.results_dir))
+    models = fit_fitts(challenges, keypresses, skip_practice=not args.include_practice)
+    if args.layout:
+        models = models[models["layout"] == args.layout]
+    for model in models:
+        print("%-10s MT = %.4f + %.4f ID  r2=%.3f  n=%d" % tuple(model))
+    corpus = load_corpus(args.dictionary, args.limit)
+    metrics.write_csv('typist-model', rank_orderings(models, [ascii_uppercase] + args.orderings, *corpus), digits=4)